@@ -20,6 +20,7 @@ from data.weighted_vectors import WeightedVectors
 n_jobs = -1
 
 def featsel(trX, trY, teX, n_feat):
+    from sklearn.feature_selection import SelectKBest, chi2 # imports scipy.stats
     print('Selecting top-%d features from %d...'%(n_feat, trX.shape[1]))
     fs = SelectKBest(chi2, k=n_feat)
     trX_ = trX.copy()
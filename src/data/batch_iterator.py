@@ -0,0 +1,75 @@
+import threading
+import time
+import Queue
+import sys
+
+"""
+Background prefetching of training batches. A producer thread repeatedly calls loader.train_batch (which includes the
+row selection, the batch representation, and the reshuffle of the training indexes at the end of each epoch) and
+places the batches in a bounded queue, so that the assembly of the next batches overlaps with the training step.
+While the iterator is open, the loader should not be asked for training batches (train_batch) by any other means.
+"""
+
+class BatchPrefetcher:
+
+    def __init__(self, loader, batch_size=64, prefetch=2):
+        if prefetch < 1:
+            raise ValueError('prefetch should be >= 1')
+        self.loader = loader
+        self.batch_size = batch_size
+        self.epoch = loader.epoch   # epoch of the last batch delivered (the loader itself may run ahead)
+        self.wait_time = 0.0        # accumulated time (in seconds) the consumer has been blocked waiting for batches
+        self.batches = 0
+        self._queue = Queue.Queue(maxsize=prefetch)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _produce(self):
+        try:
+            while not self._stop.is_set():
+                epoch = self.loader.epoch
+                item = (epoch, self.loader.train_batch(self.batch_size))
+                self._put(item)
+        except Exception:
+            self._put(sys.exc_info())
+
+    def _put(self, item):
+        # the timeout allows the producer to notice a close() while the queue is full
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._stop.is_set():
+            raise StopIteration
+        tinit = time.time()
+        item = self._queue.get()
+        self.wait_time += time.time() - tinit
+        if len(item) == 3: # exception raised in the producer
+            self.close()
+            raise item[0], item[1], item[2]
+        self.epoch, batch = item
+        self.batches += 1
+        return batch
+
+    # average time (in seconds) the consumer has waited per batch
+    def average_wait_time(self):
+        return self.wait_time / self.batches if self.batches > 0 else 0.0
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
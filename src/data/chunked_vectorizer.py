@@ -0,0 +1,55 @@
+import numbers
+from collections import Counter
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer
+from sharded_matrix import ShardedMatrixWriter
+
+"""
+Two-pass vectorization of collections whose raw text or vectorized matrix do not fit in memory. Documents are consumed
+in chunks of chunk_size documents (e.g., from the lazy MmapDocuments of a text store):
+    1st pass: fit_vocabulary builds the vocabulary and the document frequencies, with the same tokenization, min_df
+              filtering, and (alphabetical) term indexing as CountVectorizer
+    2nd pass: transform_to_shards vectorizes each chunk with the fixed vocabulary (and, optionally, re-weights it with
+              an already fitted transformer) and writes it to disk as a shard of a ShardedMatrix
+"""
+
+def iter_chunks(documents, chunk_size):
+    for i in xrange(0, len(documents), chunk_size):
+        yield documents[i:i + chunk_size]
+
+def fit_vocabulary(documents, chunk_size, stop_words=None, min_df=1):
+    """
+    :return: a tuple (vocabulary, df, nD) with the term->column dictionary, the array of document frequencies of the
+    vocabulary terms, and the number of documents
+    """
+    analyzer = CountVectorizer(stop_words=stop_words).build_analyzer()
+    doc_freq = Counter()
+    nD = 0
+    for chunk in iter_chunks(documents, chunk_size):
+        for doc in chunk:
+            doc_freq.update(set(analyzer(doc)))
+        nD += len(chunk)
+    min_doc_count = min_df if isinstance(min_df, numbers.Integral) else min_df * nD
+    terms = sorted(term for term, count in doc_freq.iteritems() if count >= min_doc_count)
+    if len(terms) == 0:
+        raise ValueError('After pruning, no terms remain. Try a lower min_df.')
+    vocabulary = dict((term, i) for i, term in enumerate(terms))
+    df = np.array([doc_freq[term] for term in terms], dtype=int)
+    return vocabulary, df, nD
+
+def transform_to_shards(documents, path, vectorizer, num_features, chunk_size, transformer=None, dtype=None):
+    """
+    :param vectorizer: a stateless (e.g., HashingVectorizer) or already fitted vectorizer
+    :param transformer: an optional already fitted transformer applied to the vectorized chunks
+    :param dtype: the dtype of the shards (if None, the dtype produced by the vectorizer or transformer is kept)
+    :return: the ShardedMatrix written in path, with one shard per chunk
+    """
+    writer = ShardedMatrixWriter(path, num_features)
+    for chunk in iter_chunks(documents, chunk_size):
+        block = vectorizer.transform(chunk)
+        if transformer is not None:
+            block = transformer.transform(block)
+        writer.append(sp.csr_matrix(block, dtype=dtype))
+    return writer.close()
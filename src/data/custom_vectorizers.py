@@ -12,6 +12,52 @@ from sklearn.utils.validation import check_is_fitted
 from sklearn.preprocessing import normalize
 from sklearn.base import BaseEstimator, TransformerMixin
 
+# Returns X as a csr_matrix with the given dtype (e.g., np.float32 halves the memory of np.float64 weights), and with
+# int32 indices whenever they suffice; if dtype is None, the dtype of X is preserved
+def as_dtype(X, dtype=None):
+    X = sp.csr_matrix(X, dtype=dtype)
+    int32_max = np.iinfo(np.int32).max
+    if X.nnz < int32_max and X.shape[1] < int32_max:
+        X.indices = X.indices.astype(np.int32, copy=False)
+        X.indptr = X.indptr.astype(np.int32, copy=False)
+    return X
+
+# Fits a TfidfTransformer from the document frequencies df of a collection of nD documents (replicating the idf computed
+# by TfidfTransformer.fit), so that collections too large to be fitted in memory can be weighted chunk by chunk
+def fit_tfidf_from_df(transformer, df, nD):
+    if transformer.use_idf:
+        n_features = len(df)
+        df = df + int(transformer.smooth_idf)
+        n_samples = nD + int(transformer.smooth_idf)
+        idf = np.log(float(n_samples) / df) + 1.0
+        transformer._idf_diag = sp.spdiags(idf, diags=0, m=n_features, n=n_features, format='csr')
+    return transformer
+
+# Updates (in place) the idf of a TfidfTransformer fitted on nD documents with the raw counts of new documents: the
+# document frequencies are recovered from the fitted idf (the inverse of fit_tfidf_from_df) and the ones of the new
+# documents are added. Returns the ratio between the new and the old idf of each feature.
+def update_tfidf_with_counts(transformer, nD, new_counts):
+    old_idf = transformer.idf_
+    smooth = int(transformer.smooth_idf)
+    df = np.rint((nD + smooth) / np.exp(old_idf - 1.0) - smooth).astype(int)
+    fit_tfidf_from_df(transformer, df + _document_frequency(new_counts), nD + new_counts.shape[0])
+    return transformer.idf_ / old_idf
+
+
+# HashingVectorizer is stateless, so the documents can be hashed in chunks of chunk_size documents by n_jobs independent
+# processes; the resulting csr blocks are stacked in the original order of the documents
+def parallel_hashing_transform(vectorizer, raw_documents, n_jobs=-1, chunk_size=1000):
+    nD = len(raw_documents)
+    if n_jobs == 1 or nD <= chunk_size:
+        return vectorizer.transform(raw_documents)
+    blocks = Parallel(n_jobs=n_jobs)(delayed(_hash_chunk)(vectorizer, raw_documents[i:i + chunk_size])
+                                     for i in xrange(0, nD, chunk_size))
+    return sp.vstack(blocks, format='csr')
+
+def _hash_chunk(vectorizer, documents):
+    return vectorizer.transform(documents)
+
+
 class BM25(BaseEstimator):
     def __init__(self, k1=1.2, b=0.75, stop_words=None, min_df=1):
         self.k1 = k1
@@ -32,41 +78,38 @@ class BM25(BaseEstimator):
 
 
 class BM25Transformer(BaseEstimator):
-    def __init__(self, k1=1.2, b=0.75, norm='none'):
+    def __init__(self, k1=1.2, b=0.75, norm='none', dtype=np.float64):
         self.k1 = k1
         self.b = b
         self.norm = norm
+        self.dtype = dtype
 
     def fit(self, coocurrence_matrix):
-        self.tf = coocurrence_matrix.asfptype().toarray()
-        self.nD = self.tf.shape[0]
-        self.avgdl = []
-        for d in range(self.nD): self.avgdl.append(self.tf[d, :].sum())
-        self.avgdl = sum(self.avgdl) * 1.0 / len(self.avgdl)
-        self.idf = dict()
-        for f in range(self.tf.shape[1]):
-            self.idf[f] = self._idf(self.nD, len(self.tf[:, f].nonzero()[0]))
+        tf = sp.csr_matrix(coocurrence_matrix, dtype=self.dtype)
+        self.nD = tf.shape[0]
+        self.avgdl = tf.sum() * 1.0 / self.nD
+        df = _document_frequency(tf)
+        self.idf = np.array([self._idf(self.nD, nd_fi) for nd_fi in df], dtype=self.dtype)
+        return self
 
     def fit_transform(self, coocurrence_matrix, y=None):
         self.fit(coocurrence_matrix)
-        return self.transform_tf(self.tf)
+        return self.transform(coocurrence_matrix)
 
     def transform(self, coocurrence_matrix, y=None):
         if not hasattr(self, 'idf'): raise NameError('BM25: transform method called before fit.')
-        tf = coocurrence_matrix.asfptype().toarray()
+        tf = sp.csr_matrix(coocurrence_matrix, dtype=self.dtype, copy=True)
         return self.transform_tf(tf)
 
+    # scores (in place) the non-zero entries of the csr matrix tf; all documents and features are processed at once
     def transform_tf(self, tf):
-        nD, nF = tf.shape
-        for d in range(nD):
-            len_d = tf[d, :].sum()
-            norm = 0.0
-            for f in tf[d].nonzero()[0]:
-                tf[d, f] = self._score(tf[d, f], self.idf[f], self.k1, self.b, len_d, self.avgdl)
-                if self.norm == 'l2': norm += (tf[d, f] * tf[d, f])
-            if self.norm == 'l2':
-                tf[d, :] /= math.sqrt(norm) if norm > 0 else 1
-        return scipy.sparse.csr_matrix(tf)
+        len_d = np.asarray(tf.sum(axis=1)).ravel()
+        doc_of_entry = np.repeat(np.arange(tf.shape[0]), np.diff(tf.indptr))
+        tf.data = self._score(tf.data, self.idf[tf.indices], self.k1, self.b, len_d[doc_of_entry], self.avgdl).astype(tf.dtype)
+        tf.eliminate_zeros()
+        if self.norm == 'l2':
+            tf = normalize(tf, norm='l2', copy=False)
+        return tf
 
     def _score(self, tfi, idfi, k1, b, len_d, avgdl):
         return idfi * (tfi * (k1 + 1) / (tfi + k1 * (1 - b + b * len_d / avgdl)))
@@ -75,15 +118,40 @@ class BM25Transformer(BaseEstimator):
         return max(math.log((nD - nd_fi + 0.5) / (nd_fi + 0.5)), 0.0)
 
 
-def wrap_contingency_table(f, feat_vec, cat_doc_set, nD):
-    feat_doc_set = set(feat_vec[:,f].nonzero()[0])
-    return feature_label_contingency_table(cat_doc_set, feat_doc_set, nD)
+class TftsrTransformer(BaseEstimator, TransformerMixin):
+    """
+    Supervised tf-TSR weighting of a raw count matrix: the (sublinear) tf, L2-normalized, is multiplied by the score
+    that the tsr_function assigns to each feature with respect to the positive documents in the binary target y, and
+    is then L2-normalized again.
+    """
+    def __init__(self, tsr_function, sublinear_tf=False, n_jobs=-1, dtype=np.float64):
+        self.tsr_function = tsr_function
+        self.sublinear_tf = sublinear_tf
+        self.n_jobs = n_jobs
+        self.dtype = dtype
+
+    def fit(self, X, y):
+        self.tf_transformer = TfidfTransformer(use_idf=False, sublinear_tf=self.sublinear_tf).fit(X)
+        positives = (np.asarray(y) == 1).astype(int).reshape(-1, 1)
+        supervised_4cell_matrix = get_supervised_matrix(X, positives, n_jobs=self.n_jobs)
+        self.supervised_info = get_tsr_matrix(supervised_4cell_matrix, self.tsr_function)[0]
+        return self
+
+    def fit_transform(self, X, y):
+        return self.fit(X, y).transform(X)
+
+    def transform(self, X):
+        if not hasattr(self, 'supervised_info'): raise NameError('TftsrTransformer: transform method called before fit.')
+        sup_w = self.tf_transformer.transform(X) * sp.diags(self.supervised_info, 0)
+        sup_w = sp.csr_matrix(sup_w, dtype=self.dtype)
+        sup_w.eliminate_zeros()
+        return normalize(sup_w, norm='l2', copy=False)
 
 """
 Supervised Term Weighting function based on any Term Selection Reduction (TSR) function (e.g., information gain,
 chi-square, etc.) or, more generally, on any function that could be computed on the 4-cell contingency table for
 each category-feature pair.
-The supervised_4cell_matrix (a CxF matrix containing the 4-cell contingency tables
+The supervised_4cell_matrix (a CxF ContingencyTensor, or matrix of ContTable, containing the 4-cell contingency tables
 for each category-feature pair) can be pre-computed (e.g., during the feature selection phase) and passed as an
 argument.
 When C>1, i.e., in multiclass scenarios, a global_policy is used in order to determine a single feature-score which
@@ -92,7 +160,7 @@ informs about its relevance. Accepted policies include "max" (takes the max scor
 (which sums all category scores).
 """
 class TSRweighting(BaseEstimator,TransformerMixin):
-    def __init__(self, tsr_function, global_policy='max', supervised_4cell_matrix=None, sublinear_tf=True, norm='l2', n_jobs=-1):
+    def __init__(self, tsr_function, global_policy='max', supervised_4cell_matrix=None, sublinear_tf=True, norm='l2', n_jobs=-1, dtype=np.float64):
         if global_policy not in ['max', 'ave', 'wave', 'sum']: raise ValueError('Global policy should be in {"max", "ave", "wave", "sum"}')
         self.tsr_function = tsr_function
         self.global_policy = global_policy
@@ -100,6 +168,7 @@ class TSRweighting(BaseEstimator,TransformerMixin):
         self.n_jobs=n_jobs
         self.sublinear_tf=sublinear_tf
         self.norm=norm
+        self.dtype=dtype
 
     def fit(self, X, y):
         self.unsupervised_vectorizer = TfidfTransformer(norm=None, use_idf=False, smooth_idf=False, sublinear_tf=self.sublinear_tf).fit(X)
@@ -111,9 +180,8 @@ class TSRweighting(BaseEstimator,TransformerMixin):
         nF = X.shape[1]
 
         if self.tsr_function.__name__ == fisher_score_binary.__name__:
-            if nC > 1: print("[Warning]: The Fisher score current implementation does only cover the binary case. A pooling will be applied.")
-            tf_X = self.unsupervised_vectorizer.transform(X).toarray()
-            tsr_matrix = [[fisher_score_binary(tf_X[:,f],y[:,c]) for f in range(nF)] for c in range(nC)]
+            # computed on the (sparse) tf matrix, for all categories at once
+            tsr_matrix = fisher_score_matrix(self.unsupervised_vectorizer.transform(X), y)
         else:
             if self.supervised_4cell_matrix is None:
                 self.supervised_4cell_matrix = get_supervised_matrix(X, y, n_jobs=self.n_jobs)
@@ -136,11 +204,13 @@ class TSRweighting(BaseEstimator,TransformerMixin):
 
     def transform(self, X):
         if not hasattr(self, 'global_tsr_vector'): raise NameError('TSRweighting: transform method called before fit.')
-        tf_X = self.unsupervised_vectorizer.transform(X).toarray()
-        weighted_X = np.multiply(tf_X, self.global_tsr_vector)
+        # the columns of the (sparse) tf matrix are scaled by the global tsr scores, with no dense nD x nF intermediate
+        tf_X = sp.csr_matrix(self.unsupervised_vectorizer.transform(X))
+        weighted_X = sp.csr_matrix(tf_X * sp.diags(np.asarray(self.global_tsr_vector, dtype=float).ravel(), 0))
+        weighted_X.eliminate_zeros()
         if self.norm is not None and self.norm!='none':
-            weighted_X = sklearn.preprocessing.normalize(weighted_X, norm=self.norm, axis=1, copy=False)
-        return scipy.sparse.csr_matrix(weighted_X)
+            weighted_X = normalize(weighted_X, norm=self.norm, axis=1, copy=False)
+        return as_dtype(weighted_X, self.dtype)
 
 
 class TfidfTransformerAlphaBeta(TfidfTransformer):
@@ -151,7 +221,7 @@ class TfidfTransformerAlphaBeta(TfidfTransformer):
     """
 
     #def __init__(self, alpha=1.0, beta=1.0, **kwargs):
-    def __init__(self, alpha=1.0, beta=1.0, norm = 'l2', use_idf = True, smooth_idf = True, sublinear_tf = False):
+    def __init__(self, alpha=1.0, beta=1.0, norm = 'l2', use_idf = True, smooth_idf = True, sublinear_tf = False, dtype=np.float64):
         self.alpha = alpha
         self.beta = beta
         #super(TfidfTransformerAlphaBeta, self).__init__(**kwargs)
@@ -159,18 +229,17 @@ class TfidfTransformerAlphaBeta(TfidfTransformer):
         self.use_idf = use_idf
         self.smooth_idf = smooth_idf
         self.sublinear_tf = sublinear_tf
+        self.dtype = dtype
 
     def transform(self, X, copy=True):
         """
         Replies the behaviour of TfidfTransformer from scikitlear, but incorporating two power parameters, alpha and
         beta so that the returned weights are tf^alpha * idf^beta. The rest is a copy of the original code
         """
-        if hasattr(X, 'dtype') and np.issubdtype(X.dtype, np.float):
-            # preserve float family dtype
-            X = sp.csr_matrix(X, copy=copy)
-        else:
-            # convert counts or binary occurrences to floats
-            X = sp.csr_matrix(X, dtype=np.float64, copy=copy)
+        # counts, binary occurrences, or float tf of any precision are cast to the dtype of the transformer (the cast
+        # already copies the matrix if the dtype differs)
+        X = as_dtype(sp.csr_matrix(X, dtype=self.dtype, copy=copy))
+        dtype = X.dtype
 
         n_samples, n_features = X.shape
 
@@ -189,6 +258,7 @@ class TfidfTransformerAlphaBeta(TfidfTransformer):
 
             # this is the only modification !
             X = X.power(self.alpha) * self._idf_diag.power(self.beta)
+            X = X.astype(dtype) # the idf is float64, which would otherwise upcast float32 weights
 
         if self.norm:
             X = normalize(X, norm=self.norm, copy=False)
@@ -197,13 +267,14 @@ class TfidfTransformerAlphaBeta(TfidfTransformer):
 
 class BM25TransformerAlphaBeta(BM25Transformer):
     #def __init__(self, alpha=1.0, beta=1.0, **kwargs):
-    def __init__(self, alpha=1.0, beta=1.0, k1=1.2, b=0.75, norm='none'):
+    def __init__(self, alpha=1.0, beta=1.0, k1=1.2, b=0.75, norm='none', dtype=np.float64):
         self.alpha = alpha
         self.beta = beta
         #super(BM25TransformerAlphaBeta, self).__init__(**kwargs)
         self.k1 = k1
         self.b = b
         self.norm = norm
+        self.dtype = dtype
 
     def _score(self, tfi, idfi, k1, b, len_d, avgdl):
         tf_part = (tfi * (k1 + 1) / (tfi + k1 * (1 - b + b * len_d / avgdl)))
@@ -212,7 +283,7 @@ class BM25TransformerAlphaBeta(BM25Transformer):
 
 class TSRweightingAlphaBeta(TSRweighting):
     #def __init__(self, tsr_function, alpha=1.0, beta=1.0, **kwargs):
-    def __init__(self, tsr_function, alpha=1.0, beta=1.0, global_policy = 'max', supervised_4cell_matrix = None, sublinear_tf = True, n_jobs = -1, norm='l2'):
+    def __init__(self, tsr_function, alpha=1.0, beta=1.0, global_policy = 'max', supervised_4cell_matrix = None, sublinear_tf = True, n_jobs = -1, norm='l2', dtype=np.float64):
         self.tsr_function = tsr_function
         self.alpha = alpha
         self.beta = beta
@@ -226,14 +297,19 @@ class TSRweightingAlphaBeta(TSRweighting):
         self.n_jobs=n_jobs
         self.sublinear_tf=sublinear_tf
         self.norm=norm
+        self.dtype=dtype
 
     def transform(self, X):
         if not hasattr(self, 'global_tsr_vector'): raise NameError('TSRweighting: transform method called before fit.')
-        tf_X = self.unsupervised_vectorizer.transform(X).toarray()
+        # tf^alpha is computed on the stored (non-zero) entries of the sparse tf matrix only
+        tf_X = sp.csr_matrix(self.unsupervised_vectorizer.transform(X), dtype=float, copy=True)
         if not self.alpha.is_integer():
-            tf_X[tf_X < 0] = 0
+            tf_X.data[tf_X.data < 0] = 0
         if not self.beta.is_integer():
             self.global_tsr_vector[self.global_tsr_vector < 0] = 0
-        weighted_X = np.multiply(np.power(tf_X, self.alpha), np.power(self.global_tsr_vector, self.beta))
-        weighted_X = sklearn.preprocessing.normalize(weighted_X, norm='l2', axis=1, copy=False)
-        return scipy.sparse.csr_matrix(weighted_X)
+        tf_X.data = np.power(tf_X.data, self.alpha)
+        tsr_beta = np.power(np.asarray(self.global_tsr_vector, dtype=float).ravel(), self.beta)
+        weighted_X = sp.csr_matrix(tf_X * sp.diags(tsr_beta, 0))
+        weighted_X.eliminate_zeros()
+        weighted_X = normalize(weighted_X, norm='l2', axis=1, copy=False)
+        return as_dtype(weighted_X, self.dtype)
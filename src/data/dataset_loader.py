@@ -1,22 +1,25 @@
 import cPickle as pickle
+import copy
+import hashlib
 import tarfile
 import time
 from glob import glob
 from os import listdir
 from os.path import join
-import nltk
 import numpy as np
-from nltk.corpus import movie_reviews
-from sklearn.datasets import fetch_20newsgroups
-from sklearn.datasets import get_data_home
-from sklearn.externals.six.moves import urllib
-from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
-from sklearn.feature_selection import SelectKBest
-from sklearn.feature_selection import chi2
+from collections import OrderedDict
+from joblib import Parallel, delayed
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer, TfidfTransformer
+from sklearn.preprocessing import Binarizer
+from feature_selection.round_robin import RoundRobin
 from data.custom_vectorizers import *
 from feature_selection.tsr_function import *
 from utils.helpers import *
-from reuters21578_parser import ReutersParser
+from text_store import open_text_store, text_store_exists, write_text_store
+from batch_iterator import BatchPrefetcher
+from label_matrix import LabelMatrix
+from sharded_matrix import ShardedMatrix, sharded_matrix_exists
+from chunked_vectorizer import fit_vocabulary, transform_to_shards
 
 
 class Dataset:
@@ -30,13 +33,47 @@ def err_exit(cond, msg):
         print(msg)
         sys.exit()
 
-class TextCollectionLoader:
+# Same folder as sklearn.datasets.get_data_home, which is not imported, since sklearn.datasets loads all its dataset
+# fetchers. The modules needed to download and parse each collection (nltk, urllib, sklearn.datasets, and the reuters
+# parser) are only imported by the fetch method of the collection, and only if it is not already in a text store.
+def get_data_home(data_home=None):
+    if data_home is None:
+        data_home = os.environ.get('SCIKIT_LEARN_DATA', join('~', 'scikit_learn_data'))
+    return create_if_not_exists(os.path.expanduser(data_home))
+
+def _read_file(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+# Reads the files in parallel, preserving the order of paths. Collections stored as one file per document are dominated
+# by I/O latency (which releases the GIL), so a pool of threads suffices
+def read_files(paths, n_jobs=-1):
+    return Parallel(n_jobs=n_jobs, backend="threading")(delayed(_read_file)(path) for path in paths)
+
+class _LazySubset(object):
+    """Holder of a subset of the collection which is only loaded (by calling load) the first time it is requested."""
+    def __init__(self, load):
+        self._load = load
+        self._loaded = None
+
+    def loaded(self):
+        return self._loaded is not None
+
+    def get(self):
+        if self._loaded is None:
+            self._loaded = self._load()
+        return self._loaded
+
+
+class TextCollectionLoader(object):
     valid_datasets = ['20newsgroups', 'reuters21578', 'ohsumed', 'movie_reviews', 'sentence_polarity', 'imdb']
     valid_vectorizers = ['tfcw', 'tfgr', 'tfidf', 'count', 'binary', 'hashing', 'sublinear_tfidf', 'sublinear_tf', 'tfchi2', 'tfig', 'tfrf', 'bm25']
-    valid_repmodes = ['sparse', 'dense', 'sparse_index']
+    valid_repmodes = ['sparse', 'dense', 'sparse_index', 'padded_index']
+    valid_outofcore_vectorizers = ['count', 'binary', 'hashing', 'tfidf', 'sublinear_tfidf', 'sublinear_tf']
     valid_catcodes = {'20newsgroups':range(20), 'reuters21578':range(115), 'ohsumed':range(23), 'movie_reviews':[1], 'sentence_polarity':[1], 'imdb':[1]}
-    version=1.0
-    def __init__(self, dataset, valid_proportion=0.2, vectorizer='hashing', rep_mode='sparse', positive_cat=None, feat_sel=None):
+    version=1.2
+    def __init__(self, dataset, valid_proportion=0.2, vectorizer='hashing', rep_mode='sparse', positive_cat=None, feat_sel=None,
+                 min_df=1, stop_words='english', use_cache=True, cache_dir=None, chunk_size=None, dtype=None, score_func=None):
         err_param_range('vectorize', vectorizer, valid_values=TextCollectionLoader.valid_vectorizers)
         err_param_range('rep_mode', rep_mode, valid_values=TextCollectionLoader.valid_repmodes)
         err_param_range('dataset', dataset, valid_values=TextCollectionLoader.valid_datasets)
@@ -44,77 +81,257 @@ class TextCollectionLoader:
         self.name = dataset
         self.vectorizer=vectorizer
         self.rep_mode=rep_mode
+        self.min_df=min_df
+        self.stop_words=stop_words
+        self.feat_sel=feat_sel
+        self.chunk_size=chunk_size
+        self.dtype=dtype # dtype of the vectorized matrices (e.g., np.float32); None keeps the one of the vectorizer
+        self.score_func=score_func # tsr function for feature selection (see feature_ranking); None stands for chi2
+        if chunk_size is not None:
+            err_param_range('vectorizer (out-of-core)', vectorizer, valid_values=TextCollectionLoader.valid_outofcore_vectorizers)
+            err_exception(feat_sel is not None, 'Error. Feature selection is not available in out-of-core mode (chunk_size).')
         self.cat_vec_dic = dict()
         self.supervised_4cell_matrix = None
         if dataset == '20newsgroups':
-            self.devel = self.fetch_20newsgroups(subset='train')
-            self.test  = self.fetch_20newsgroups(subset='test')
             self.classification = 'single-label'
-        elif dataset == 'reuters21578':
-            self.devel = self.fetch_reuters21579(subset='train')
-            self.test  = self.fetch_reuters21579(subset='test')
+        elif dataset in ['reuters21578', 'ohsumed']:
             self.classification = 'multi-label'
-        elif dataset == 'ohsumed':
-            self.devel = self.fetch_ohsumed50k(subset='train')
-            self.test = self.fetch_ohsumed50k(subset='test')
-            self.classification = 'multi-label'
-        elif dataset == 'movie_reviews':
-            self.devel = self.fetch_movie_reviews(subset='train')
-            self.test = self.fetch_movie_reviews(subset='test')
-            self.classification = 'polarity'
-        elif dataset == 'sentence_polarity':
-            self.devel = self.fetch_sentence_polarity(subset='train')
-            self.test = self.fetch_sentence_polarity(subset='test')
-            self.classification = 'polarity'
-        elif dataset == 'imdb':
-            self.devel = self.fetch_IMDB(subset='train')
-            self.test = self.fetch_IMDB(subset='test')
+        else:
             self.classification = 'polarity'
+        self.devel = self._fetch_subset('train')
         self.epoch = 0
         self.offset = 0
         self.positive_cat = positive_cat
-        self.devel_vec, self.test_vec = self._vectorize_documents()
-        self.devel_indexes = self._get_doc_indexes(self.devel_vec)
-        self.test_indexes  = self._get_doc_indexes(self.test_vec)
+        self.devel_labels = LabelMatrix(self.devel.target, len(self.devel.target_names))
+        self._set_weight_getter()
+        self._selected_features = None
+        self._appended_counts = [] # raw counts of the documents added with append_documents
+        self._appended = False # once documents are appended, no cache is written to disk (their keys do not describe them)
+        self._test = self._test_labels = self._test_vec = self._test_indexes = None
+        # in out-of-core mode the sharded matrices written to disk act as the cache of the vectorized corpus
+        self._use_cache = use_cache
+        self._cache_dir = cache_dir
+        self._vectorized_path = self._vectorized_cache_path(cache_dir) if use_cache and chunk_size is None else None
+        from_cache = self._vectorized_path is not None and os.path.exists(self._vectorized_path)
+        if from_cache:
+            self._load_vectorized(self._vectorized_path)
+        else:
+            if chunk_size is None:
+                self.devel_vec = self._vectorize_devel()
+            else:
+                self.devel_vec = self._vectorize_devel_out_of_core(cache_dir, use_cache)
+            self.devel_indexes = self._get_doc_indexes(self.devel_vec)
+        # the test subset is only fetched, vectorized, and feature-selected the first time it is requested (see the
+        # test, test_vec, test_indexes, and test_labels properties); the holder is shared with the views of this loader
+        self._test_subset = _LazySubset(self._load_test_subset)
+        if self.positive_cat is not None:
+            print('Binarize towards positive category %s' % self.devel.target_names[self.positive_cat])
+            self.binarize_classes()
+            self.divide_train_val_evenly(valid_proportion=valid_proportion)
+        if not from_cache:
+            if feat_sel is not None:
+                self.feature_selection(int(feat_sel*self.num_features()), score_func=self.score_func)
+            if self._vectorized_path is not None:
+                self._dump_vectorized(self._vectorized_path)
+        # the fitted transformer and selection described by the cache key (see _test_cache_path)
+        self._cached_fit = (self._transformer, self._selected_features)
         if self.rep_mode=='dense':
-            self.devel_vec = self.devel_vec.todense()
-            self.test_vec = self.test_vec.todense()
+            # the corpus is kept sparse; only the rows of each requested batch are densified
             self._batch_getter = self._dense_batch_getter
         elif self.rep_mode=='sparse':
             # already sparse representation
             self._batch_getter = self._sparse_batch_getter
-        else: #sparse index
-            # already sparse representation
+        elif self.rep_mode=='sparse_index':
+            # ragged (row, feature-id, weight) triplets, read from the csr arrays of the batch
             self._batch_getter = self._sparse_index_batch_getter
-        if self.positive_cat is not None:
-            print('Binarize towards positive category %s' % self.devel.target_names[self.positive_cat])
-            self.binarize_classes()
-            self.divide_train_val_evenly(valid_proportion=valid_proportion)
-        if feat_sel is not None:
-            self.feature_selection(int(feat_sel*self.num_features()))
+        else: #padded index
+            # feature-ids and weights padded to the longest document of the batch
+            self._batch_getter = self._padded_index_batch_getter
+
+    # The vectorized corpus (post-vectorization and post-selection matrices, vocabulary and document indexes) only depends
+    # on the parameters below, so they are hashed into the name of the cache file. The positive category only takes part
+    # in the key if the corpus depends on it (supervised tf-tsr weightings, or feature selection), so that the loaders of
+    # all categories share the same unsupervised corpus. Changes in the vectorization code should bump the loader version
+    # in order to invalidate previous caches.
+    def _vectorized_cache_path(self, cache_dir=None):
+        cache_dir = self._vectorized_cache_dir(cache_dir)
+        depends_on_cat = self.feat_sel is not None or self.vectorizer in ['tfig', 'tfgr', 'tfchi2', 'tfrf', 'tfcw']
+        key = (self.name, self.vectorizer, self.min_df, self.stop_words, self.feat_sel, TextCollectionLoader.version)
+        if depends_on_cat: key += (self.positive_cat,)
+        if self.dtype is not None: key += (np.dtype(self.dtype).name,)
+        if self.score_func is not None: key += (self.score_func.__name__,)
+        return os.path.join(cache_dir, '%s.%s.pickle' % (self.name, hashlib.md5(str(key)).hexdigest()))
+
+    # the folder of all the caches of vectorized data (corpora, raw counts, and feature rankings)
+    def _vectorized_cache_dir(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = os.path.join(get_data_home(), 'vectorized')
+        return create_if_not_exists(cache_dir)
+
+    def _load_vectorized(self, path):
+        tini = time.time()
+        cached = pickle.load(open(path, 'rb'))
+        self.devel_vec, self.devel_indexes = cached['devel_vec'], cached['devel_indexes']
+        self.vocabulary, self._count_vocabulary = cached['vocabulary'], cached['count_vocabulary']
+        self._transformer, self._selected_features = cached['transformer'], cached['selected_features']
+        print("Vectorized corpus loaded from %s in %.3fs" % (path, time.time() - tini))
+
+    # the fitted transformer and selected features are kept, so that the test subset can be vectorized afterwards
+    def _dump_vectorized(self, path):
+        cached = {'devel_vec': self.devel_vec, 'devel_indexes': self.devel_indexes,
+                  'vocabulary': self.vocabulary, 'count_vocabulary': self._count_vocabulary,
+                  'transformer': self._transformer, 'selected_features': self._selected_features}
+        if not self._appended:
+            pickle_atomic(cached, path)
+
+    def _fetch_subset(self, subset):
+        if self.name == '20newsgroups':
+            return self.fetch_20newsgroups(subset=subset)
+        elif self.name == 'reuters21578':
+            return self.fetch_reuters21579(subset=subset)
+        elif self.name == 'ohsumed':
+            return self.fetch_ohsumed50k(subset=subset)
+        elif self.name == 'movie_reviews':
+            return self.fetch_movie_reviews(subset=subset)
+        elif self.name == 'sentence_polarity':
+            return self.fetch_sentence_polarity(subset=subset)
+        elif self.name == 'imdb':
+            return self.fetch_IMDB(subset=subset)
+
+    # The vectorized test subset is cached next to the vectorized devel subset, as long as it is vectorized with the
+    # transformer of the cache (not with one refitted afterwards, e.g., by append_documents). If features were selected
+    # after the construction (see feature_selection), the digest of the selected features is added to the file name.
+    # Returns None if the test subset can not be cached.
+    def _test_cache_path(self):
+        if self._vectorized_path is None: return None
+        transformer, selected_features = self._cached_fit
+        if self._transformer is not transformer: return None
+        prefix = os.path.splitext(self._vectorized_path)[0] + '.test'
+        if self._selected_features is not selected_features:
+            prefix += '.' + hashlib.md5(np.asarray(self._selected_features).tobytes()).hexdigest()
+        return prefix + '.pickle'
+
+    # Fetches, vectorizes (with the vectorizer fitted on the devel subset), and feature-selects the test subset; the
+    # vectorized test subset is cached on disk (see _test_cache_path). As for the devel subset, the valid documents are
+    # those with some feature before the feature selection
+    def _load_test_subset(self):
+        tini = time.time()
+        test = self._fetch_subset('test')
+        labels = LabelMatrix(test.target, len(test.target_names))
+        test_path = self._test_cache_path()
+        if test_path is not None and os.path.exists(test_path):
+            cached = pickle.load(open(test_path, 'rb'))
+            test_vec, test_indexes = cached['test_vec'], cached['test_indexes']
+        else:
+            if self.chunk_size is None:
+                test_vec = self._vectorize_test(test.data)
+            else:
+                test_vec = self._vectorize_test_out_of_core(test.data)
+            test_indexes = self._get_doc_indexes(test_vec)
+            if self._selected_features is not None:
+                test_vec = test_vec[:, self._selected_features]
+            if test_path is not None and not self._appended:
+                cached = {'test_vec': test_vec, 'test_indexes': test_indexes}
+                pickle_atomic(cached, test_path)
+        print("Test subset loaded in %.3fs" % (time.time() - tini))
+        return {'dataset': test, 'vec': test_vec, 'indexes': test_indexes, 'labels': labels}
+
+    # derives the test Dataset and label matrix of this loader (binarized, if so is the loader) from the test subset
+    def _derive_test(self):
+        subset = self._test_subset.get()
+        test, labels = subset['dataset'], subset['labels']
+        if self.classification == 'binary':
+            target = labels.binary_vector(self.positive_cat)
+            self._test = Dataset(data=test.data, target=target, target_names=['negative', 'positive'])
+            self._test_labels = LabelMatrix(target, 2)
+        else:
+            self._test = Dataset(data=test.data, target=test.target, target_names=test.target_names)
+            self._test_labels = labels
+
+    @property
+    def test(self):
+        if self._test is None: self._derive_test()
+        return self._test
+
+    @test.setter
+    def test(self, test):
+        self._test = test
+
+    @property
+    def test_labels(self):
+        if self._test_labels is None: self._derive_test()
+        return self._test_labels
+
+    @test_labels.setter
+    def test_labels(self, test_labels):
+        self._test_labels = test_labels
+
+    @property
+    def test_vec(self):
+        return self._test_vec if self._test_vec is not None else self._test_subset.get()['vec']
+
+    @test_vec.setter
+    def test_vec(self, test_vec):
+        self._test_vec = test_vec
+
+    @property
+    def test_indexes(self):
+        return self._test_indexes if self._test_indexes is not None else self._test_subset.get()['indexes']
+
+    @test_indexes.setter
+    def test_indexes(self, test_indexes):
+        self._test_indexes = test_indexes
+
+    # Returns a binary view of the collection towards the category cat. The view is a shallow copy of this loader, so
+    # that the (possibly huge) devel and test matrices, the raw documents, and the document indexes are shared with no
+    # copy (the test subset is loaded only once, by whichever loader or view first requests it); only the binarized
+    # label vectors (and their label matrices) and the train/validation index arrays are owned by each view, which
+    # binarizes from the multi-label matrix of this loader.
+    # This allows to sweep all categories of a collection with one single vectorization. Views can not be taken from a
+    # feature-selected loader, since the features of a binarized loader are selected towards its positive category.
+    def view(self, cat, valid_proportion=0.2):
+        err_exception(self.positive_cat is not None, 'Error. Views can only be taken from a non-binarized loader.')
+        err_exception(self.vectorizer in ['tfig', 'tfgr', 'tfchi2', 'tfrf', 'tfcw'],
+                      'Error. Supervised vectorizer %s depends on the positive category and can not be shared among views.' % self.vectorizer)
+        err_exception(self._selected_features is not None,
+                      'Error. Features selected for all categories can not be shared among views; use positive_cat and feat_sel instead.')
+        err_exception(cat not in TextCollectionLoader.valid_catcodes[self.name], 'Error. Positive category not in scope.')
+        view = copy.copy(self)
+        view.devel = Dataset(data=self.devel.data, target=self.devel.target, target_names=self.devel.target_names)
+        view._test = view._test_labels = None
+        view.positive_cat = cat
+        view.epoch = 0
+        view.offset = 0
+        view.supervised_4cell_matrix = None
+        view.binarize_classes()
+        view.divide_train_val_evenly(valid_proportion=valid_proportion)
+        return view
 
     # Ensures the train and validation splits to approximately preserve the original devel prevalence.
     # In extremely imbalanced cases, the train set is guaranteed to have some positive examples
     def divide_train_val_evenly(self, valid_proportion=0.5, pos_cat_code=1):
-        pos_indexes = [ind for ind in self.devel_indexes if self.devel.target[ind] == pos_cat_code]
-        neg_indexes = [ind for ind in self.devel_indexes if self.devel.target[ind] != pos_cat_code]
+        devel_indexes = np.asarray(self.devel_indexes, dtype=int)
+        is_positive = np.asarray(self.devel.target)[devel_indexes] == pos_cat_code
+        pos_indexes = devel_indexes[is_positive]
+        neg_indexes = devel_indexes[~is_positive]
         pos_split_point = int(math.ceil(len(pos_indexes)*(1.0-valid_proportion)))
         neg_split_point = int(math.ceil(len(neg_indexes)*(1.0-valid_proportion)))
-        self.train_indexes = np.array(pos_indexes[:pos_split_point] + neg_indexes[:neg_split_point])
-        self.valid_indexes = np.array(pos_indexes[pos_split_point:] + neg_indexes[neg_split_point:])
+        self.train_indexes = np.concatenate((pos_indexes[:pos_split_point], neg_indexes[:neg_split_point]))
+        self.valid_indexes = np.concatenate((pos_indexes[pos_split_point:], neg_indexes[neg_split_point:]))
 
     # change class codes: positive class = 1, all others = 0, and set category names to 'positive' or 'negative'
     def binarize_classes(self):
         self.cat_name = self.devel.target_names[self.positive_cat]
-        self.devel.target = self.binarize_label_vector(self.devel.target, self.classification, self.positive_cat)
-        self.test.target = self.binarize_label_vector(self.test.target, self.classification, self.positive_cat)
-        self.devel.target_names = self.test.target_names = ['negative', 'positive']
+        self.devel.target = self.devel_labels.binary_vector(self.positive_cat)
+        self.devel.target_names = ['negative', 'positive']
         self.classification = 'binary' #informs that the category codes have been set to 0 for negative and 1 for positive
+        self.devel_labels = LabelMatrix(self.devel.target, 2)
+        self._test = self._test_labels = None # the test subset is binarized when derived (see _derive_test)
         self.cat_vec_dic = dict()
 
     def binarize_label_vector(self, labels, classification_type, pos_code=1):
         if classification_type in ['single-label']:
-            return np.array([(1 if pos_code == label_code else 0) for label_code in labels])
+            return (np.asarray(labels) == pos_code).astype(int)
         elif classification_type=='multi-label':
             return np.array([(1 if pos_code in doc_labels else 0) for doc_labels in labels])
         elif classification_type in ['binary', 'polarity']:
@@ -122,72 +339,321 @@ class TextCollectionLoader:
         else:
             err_exit(err_msg='Error while binarizing category codes: unexpected classification type.')
 
-    def feature_selection(self, feat_sel):
+    # Keeps the feat_sel top-ranked features (see feature_ranking); as the ranking is cached, selecting any number of
+    # features from the same corpus and labels amounts to a column slice. A ranking of the current columns (e.g., one
+    # computed with other labels) can be given instead of score_func. The selection only affects this loader, so that
+    # different selections can be taken from shallow copies (copy.copy) of one same loader.
+    def feature_selection(self, feat_sel, score_func=None, ranking=None):
         if self.vectorizer == 'hashing':
             print 'Warning: feature selection ommitted when hashing is activated'
             return
         if feat_sel is not None and feat_sel < self.devel_vec.shape[1]:
             print('Selecting %d most important features from %d features' % (feat_sel, self.num_features()))
-            fs = SelectKBest(chi2, k=feat_sel)
-            self.devel_vec = fs.fit_transform(self.devel_vec, self.devel.target)
-            self.test_vec = fs.transform(self.test_vec)
+            if ranking is None:
+                ranking = self.feature_ranking(score_func)
+            selected = np.sort(ranking[:feat_sel])
+            self.devel_vec = self.devel_vec[:, selected]
+            # the selection is applied to the test subset when loaded, or right away if it is already loaded
+            self._selected_features = selected if self._selected_features is None else self._selected_features[selected]
+            if self._test_vec is not None or self._test_subset.loaded():
+                self.test_vec = self.test_vec[:, selected] # the test indexes are kept, as the devel indexes
+            else: # the test subset shared with copies or views would be selected as the loader that first requests it
+                self._test_subset = _LazySubset(self._load_test_subset)
+            self.vocabulary = self._select_vocabulary(self.vocabulary, selected)
+
+    # Returns all the features (columns of devel_vec) ranked from most to least important. With score_func=None the
+    # features are ranked by chi2 (as in SelectKBest(chi2), including its handling of ties and nan scores), except in
+    # multi-label collections, in which chi_square scores are combined by RoundRobin across categories; any other tsr
+    # function is combined by RoundRobin. The ranking is computed once per (corpus, labels, score function) and is
+    # cached on disk (unless use_cache=False).
+    def feature_ranking(self, score_func=None):
+        labels = self._ranking_labels()
+        labels_digest = hashlib.md5(labels.indices.tobytes() + labels.indptr.tobytes()).hexdigest()
+        columns_digest = 'all' if self._selected_features is None else hashlib.md5(np.asarray(self._selected_features).tobytes()).hexdigest()
+        key = (self.name, self.vectorizer, self.min_df, self.stop_words, self.num_features(), columns_digest, labels_digest,
+               score_func.__name__ if score_func is not None else 'chi2', TextCollectionLoader.version)
+        if self.dtype is not None: key += (np.dtype(self.dtype).name,)
+        ranking_path = None
+        if self._use_cache:
+            cache_dir = self._vectorized_cache_dir(self._cache_dir)
+            ranking_path = os.path.join(cache_dir, '%s.rank.%s.pickle' % (self.name, hashlib.md5(str(key)).hexdigest()))
+        if ranking_path is not None and os.path.exists(ranking_path):
+            return pickle.load(open(ranking_path, 'rb'))
+        tini = time.time()
+        if score_func is None and self.classification != 'multi-label':
+            from sklearn.feature_selection import chi2 # imports scipy.stats
+            scores, _ = chi2(self.devel_vec, self.devel.target)
+            scores[np.isnan(scores)] = np.finfo(scores.dtype).min
+            ranking = np.argsort(scores, kind='mergesort')[::-1]
+        else:
+            if self.classification in ['binary', 'polarity']:
+                labels = labels[:, 1] # the positive class only
+            rr = RoundRobin(k=self.num_features(), score_func=score_func if score_func is not None else chi_square)
+            rr.fit(self.devel_vec, labels)
+            ranking = np.asarray(rr._features_rank)
+        print("Feature ranking took %.3fs" % (time.time() - tini))
+        if ranking_path is not None and not self._appended:
+            pickle_atomic(ranking, ranking_path)
+        return ranking
+
+    # sparse indicator matrix of the current devel labels (these could have been replaced after the loader construction)
+    def _ranking_labels(self):
+        target = self.devel.target
+        if isinstance(target, np.ndarray) and target.ndim == 2: # already an indicator matrix
+            return csr_matrix(target)
+        return LabelMatrix(target, len(self.devel.target_names)).matrix
+
+    # Appends new labelled documents to the devel set without refitting the vectorizer: only the new texts are tokenized
+    # (with the fitted vocabulary, so that unseen terms are ignored) and the devel matrix, document indexes, and labels are
+    # extended in place. The labels are coded as the categories of the collection (they are binarized if the loader is).
+    # The idf of the tfidf weightings is updated with the document frequencies of the new documents (re-weighting the
+    # previous ones accordingly) and the supervised 4-cell matrix, if already computed, is added the contingency tables
+    # of the new documents. The new documents join the training set. If the idf is updated, a test subset already loaded
+    # is vectorized again (with the new idf) when next requested. Neither the raw texts nor the caches on disk are
+    # updated, and from then on no cache is written to disk.
+    def append_documents(self, texts, labels):
+        err_exception(len(texts) != len(labels), 'Error. Got %d texts but %d labels.' % (len(texts), len(labels)))
+        err_exception(isinstance(self.devel_vec, ShardedMatrix), 'Error. Documents can not be appended in out-of-core mode (chunk_size).')
+        err_exception(self.vectorizer in ['bm25', 'tfig', 'tfgr', 'tfchi2', 'tfrf', 'tfcw'],
+                      'Error. Documents can not be appended with vectorizer %s, which should be refitted.' % self.vectorizer)
+        if len(texts) == 0: return
+        tini = time.time()
+        self._appended = True
+        nD = self.devel_vec.shape[0]
+        if self.vectorizer == 'hashing':
+            new_vec = parallel_hashing_transform(self._hashing_vectorizer(), texts)
+            new_valid = self._get_doc_indexes(new_vec)
+        else:
+            new_counts = CountVectorizer(stop_words=self.stop_words, vocabulary=self._count_vocabulary).transform(texts)
+            if self.dtype is not None:
+                new_counts = as_dtype(new_counts, self.dtype)
+            if isinstance(self._transformer, TfidfTransformer) and self._transformer.use_idf:
+                self._update_idf(new_counts)
+            self._appended_counts = self._appended_counts + [new_counts]
+            new_vec = new_counts if self._transformer is None else self._transformer.transform(new_counts)
+            new_valid = self._get_doc_indexes(new_vec) # before the feature selection, as the devel indexes
+            if self._selected_features is not None:
+                new_vec = new_vec[:, self._selected_features]
+        if self.dtype is not None:
+            new_vec = as_dtype(new_vec, self.dtype)
+        new_vec = csr_matrix(new_vec)
+        new_vec.sort_indices()
+        self.devel_vec = sp.vstack([self.devel_vec, new_vec], format='csr')
+        if self.dtype is not None:
+            self.devel_vec = as_dtype(self.devel_vec, self.dtype)
+
+        if self.classification == 'binary':
+            labels = LabelMatrix(labels, self.positive_cat + 1).binary_vector(self.positive_cat)
+        if isinstance(self.devel.target, np.ndarray):
+            self.devel.target = np.concatenate((self.devel.target, np.asarray(labels, dtype=self.devel.target.dtype)))
+        else:
+            self.devel.target = list(self.devel.target) + list(labels)
+        nC = self.devel_labels.matrix.shape[1]
+        self.devel_labels.append(labels)
+        self.cat_vec_dic = dict()
 
-    def __prevalence(self, inset, cat_label=1):
-        return sum(1.0 for x in inset if x == cat_label) / len(inset)
+        new_indexes = (nD + np.asarray(new_valid, dtype=int)).tolist()
+        self.devel_indexes = list(self.devel_indexes) + new_indexes
+        if hasattr(self, 'train_indexes'):
+            self.train_indexes = np.concatenate((self.train_indexes, np.asarray(new_indexes, dtype=int)))
+        if self.supervised_4cell_matrix is not None:
+            if self.devel_labels.matrix.shape[1] != nC: # new categories; the matrix is recomputed when requested
+                self.supervised_4cell_matrix = None
+            elif len(new_indexes) > 0:
+                # the idf re-weighting does not change which features occur in the previous documents
+                columns = [1] if self.classification in ['binary', 'polarity'] else None
+                self.supervised_4cell_matrix.add(self.devel_vec[new_indexes], self.devel_labels.submatrix(new_indexes, columns=columns))
+        print("Appending %d documents took %.3fs" % (len(texts), time.time() - tini))
+
+    # Refits the idf with the new raw counts and re-weights the previous devel documents with the new idf. The l2
+    # normalization is a per-document scaling, so rescaling the columns with the idf ratio and normalizing again gives
+    # the weights of the new idf; but after the feature selection the norms of the previous documents depend on
+    # discarded features, so the previous documents are then weighted again from their (cached) raw counts.
+    def _update_idf(self, new_counts):
+        self._transformer = copy.copy(self._transformer) # the fitted transformer might be shared with views
+        idf_ratio = update_tfidf_with_counts(self._transformer, self.devel_vec.shape[0], new_counts)
+        if self._selected_features is None:
+            devel_vec = self.devel_vec * sp.diags(idf_ratio, 0)
+            if self._transformer.norm is not None:
+                devel_vec = normalize(devel_vec, norm=self._transformer.norm, copy=False)
+        else:
+            devel_counts = sp.vstack([self._count_documents()[0]] + self._appended_counts, format='csr')
+            if self.dtype is not None:
+                devel_counts = as_dtype(devel_counts, self.dtype)
+            devel_vec = self._transformer.transform(devel_counts)[:, self._selected_features]
+        if self.dtype is not None:
+            devel_vec = as_dtype(devel_vec, self.dtype)
+        devel_vec = csr_matrix(devel_vec)
+        devel_vec.sort_indices()
+        self.devel_vec = devel_vec
+        # the test subset was weighted with the previous idf (the holder shared with views is left untouched)
+        self._test_vec = self._test_indexes = None
+        self._test_subset = _LazySubset(self._load_test_subset)
+
+    # re-indexes the vocabulary (term -> column) after the columns in selected_features have been kept
+    def _select_vocabulary(self, vocabulary, selected_features):
+        if vocabulary is None: return None
+        new_index = dict((old, new) for new, old in enumerate(selected_features))
+        return dict((term, new_index[col]) for term, col in vocabulary.items() if col in new_index)
 
     def devel_class_prevalence(self, cat_label=1):
-        return self.__prevalence(self.devel.target[self.devel_indexes], cat_label)
+        return self.devel_labels.prevalence(cat_label, self.devel_indexes)
 
     def train_class_prevalence(self, cat_label=1):
-        return self.__prevalence(self.devel.target[self.train_indexes], cat_label)
+        return self.devel_labels.prevalence(cat_label, self.train_indexes)
 
     def valid_class_prevalence(self, cat_label=1):
-        return self.__prevalence(self.devel.target[self.valid_indexes], cat_label)
+        return self.devel_labels.prevalence(cat_label, self.valid_indexes)
 
     def test_class_prevalence(self, cat_label=1):
-        return self.__prevalence(self.test.target[self.test_indexes], cat_label)
+        return self.test_labels.prevalence(cat_label, self.test_indexes)
 
-    def _vectorize_documents(self):
-        min_df = 1
-        self.weight_getter = self._get_weights #default getter
-        if self.vectorizer == 'hashing':
-            vectorizer = HashingVectorizer(n_features=2**16, stop_words='english', non_negative=True)
-            self.weight_getter = self._get_none
-        elif self.vectorizer == 'tfidf':
-            vectorizer = TfidfVectorizer(stop_words='english', min_df=min_df)
-        elif self.vectorizer == 'sublinear_tfidf':
-            vectorizer = TfidfVectorizer(stop_words='english', sublinear_tf=True, min_df=min_df)
-        elif self.vectorizer in ['tfig', 'tfgr', 'tfchi2', 'tfrf', 'tfcw']:
-            binary_target = self.binarize_label_vector(self.devel.target, self.classification, self.positive_cat)
-            if self.vectorizer == 'tfig':
-                vectorizer = TftsrVectorizer(binary_target, information_gain, stop_words='english', sublinear_tf=True, min_df=min_df)
-            elif self.vectorizer == 'tfchi2':
-                vectorizer = TftsrVectorizer(binary_target, chi_square, stop_words='english', sublinear_tf=True, min_df=min_df)
-            elif self.vectorizer == 'tfgr':
-                vectorizer = TftsrVectorizer(binary_target, gain_ratio, stop_words='english', sublinear_tf=True, min_df=min_df)
-            elif self.vectorizer == 'tfrf':
-                vectorizer = TftsrVectorizer(binary_target, relevance_frequency, stop_words='english', sublinear_tf=True, min_df=min_df)
-            elif self.vectorizer == 'tfcw':
-                vectorizer = TftsrVectorizer(binary_target, conf_weight, stop_words='english', sublinear_tf=True, min_df=min_df)
-        elif self.vectorizer == 'sublinear_tf':
-            vectorizer = TfidfVectorizer(stop_words='english', sublinear_tf=True, use_idf=False, min_df=min_df)
-        elif self.vectorizer == 'bm25':
-            vectorizer = BM25(stop_words='english', min_df=min_df)
-        elif self.vectorizer == 'count':
-            vectorizer = CountVectorizer(stop_words='english', min_df=min_df)
-        elif self.vectorizer == 'binary':
-            vectorizer = CountVectorizer(stop_words='english', binary=True, min_df=min_df)
+    def _set_weight_getter(self):
+        if self.vectorizer in ['hashing', 'binary']:
             self.weight_getter = self._get_none
+        else:
+            self.weight_getter = self._get_weights #default getter
 
+    # All vectorizers but hashing derive their weights from one single raw count matrix (see _count_documents), so the
+    # text is tokenized only once, whatever the weighting
+    def _vectorize_devel(self):
         tini=time.time()
-
-        devel_vec = vectorizer.fit_transform(self.devel.data)
-        test_vec = vectorizer.transform(self.test.data)
+        if self.vectorizer == 'hashing':
+            devel_vec = parallel_hashing_transform(self._hashing_vectorizer(), self.devel.data)
+            self.vocabulary = self._count_vocabulary = None
+            self._transformer = None
+        else:
+            devel_counts, self._count_vocabulary = self._count_documents()
+            self.vocabulary = self._count_vocabulary
+            if self.dtype is not None:
+                devel_counts = as_dtype(devel_counts, self.dtype)
+            self._transformer = self._weighting_transformer()
+            if self._transformer is None:
+                devel_vec = devel_counts
+            elif self.vectorizer in ['tfig', 'tfgr', 'tfchi2', 'tfrf', 'tfcw']:
+                devel_vec = self._transformer.fit_transform(devel_counts, self.devel_labels.binary_vector(self.positive_cat))
+            else:
+                devel_vec = self._transformer.fit_transform(devel_counts)
+        if self.dtype is not None:
+            devel_vec = as_dtype(devel_vec, self.dtype)
         print("Vectorizer took %ds" % (time.time()-tini))
         #sorting the indexes simplifies the creation of sparse tensors a lot
         devel_vec.sort_indices()
+        return devel_vec
+
+    def _vectorize_test(self, documents):
+        if self.vectorizer == 'hashing':
+            test_vec = parallel_hashing_transform(self._hashing_vectorizer(), documents)
+        else:
+            test_vec = self._count_test_documents(documents)
+            if self.dtype is not None:
+                test_vec = as_dtype(test_vec, self.dtype)
+            if self._transformer is not None:
+                test_vec = self._transformer.transform(test_vec)
+        if self.dtype is not None:
+            test_vec = as_dtype(test_vec, self.dtype)
         test_vec.sort_indices()
-        return devel_vec, test_vec
+        return test_vec
+
+    def _hashing_vectorizer(self):
+        return HashingVectorizer(n_features=2**16, stop_words=self.stop_words, non_negative=True)
+
+    # Out-of-core vectorization: the documents are read in chunks of chunk_size documents; a first pass builds the
+    # vocabulary and document frequencies, and a second pass writes the (weighted) matrices to disk as CSR shards, so
+    # that devel_vec and test_vec become ShardedMatrix objects
+    def _vectorize_devel_out_of_core(self, cache_dir=None, use_cache=True):
+        self._shards_path = self._vectorized_cache_path(cache_dir).replace('.pickle', '.shards')
+        devel_path, fitted_path = join(self._shards_path, 'devel'), join(self._shards_path, 'fitted.pickle')
+        if use_cache and sharded_matrix_exists(devel_path) and os.path.exists(fitted_path):
+            fitted = pickle.load(open(fitted_path, 'rb'))
+            self.vocabulary, self._transformer = fitted['vocabulary'], fitted['transformer']
+            print("Sharded corpus loaded from %s" % self._shards_path)
+            return ShardedMatrix(devel_path)
+        tini=time.time()
+        if self.vectorizer == 'hashing':
+            self.vocabulary = None
+            self._transformer = None
+        else:
+            self.vocabulary, df, nD = fit_vocabulary(self.devel.data, self.chunk_size, self.stop_words, self.min_df)
+            self._transformer = self._weighting_transformer()
+            if isinstance(self._transformer, TfidfTransformer):
+                fit_tfidf_from_df(self._transformer, df, nD)
+        vectorizer, num_features = self._chunk_vectorizer()
+        devel_vec = transform_to_shards(self.devel.data, devel_path, vectorizer, num_features, self.chunk_size, self._transformer, self.dtype)
+        fitted = {'vocabulary': self.vocabulary, 'transformer': self._transformer}
+        pickle_atomic(fitted, fitted_path)
+        print("Out-of-core vectorizer took %ds" % (time.time()-tini))
+        return devel_vec
+
+    def _vectorize_test_out_of_core(self, documents):
+        test_path = join(self._shards_path, 'test')
+        if self._use_cache and sharded_matrix_exists(test_path):
+            return ShardedMatrix(test_path)
+        vectorizer, num_features = self._chunk_vectorizer()
+        return transform_to_shards(documents, test_path, vectorizer, num_features, self.chunk_size, self._transformer, self.dtype)
+
+    # the (stateless) vectorizer applied to each chunk in out-of-core mode, and the number of features it produces
+    def _chunk_vectorizer(self):
+        if self.vectorizer == 'hashing':
+            vectorizer = self._hashing_vectorizer()
+            return vectorizer, vectorizer.n_features
+        return CountVectorizer(stop_words=self.stop_words, vocabulary=self.vocabulary), len(self.vocabulary)
+
+    # returns the transformer mapping raw counts into the weighting of the vectorizer (None for raw counts)
+    def _weighting_transformer(self):
+        if self.vectorizer == 'count':
+            return None
+        elif self.vectorizer == 'binary':
+            return Binarizer()
+        elif self.vectorizer == 'tfidf':
+            return TfidfTransformer()
+        elif self.vectorizer == 'sublinear_tfidf':
+            return TfidfTransformer(sublinear_tf=True)
+        elif self.vectorizer == 'sublinear_tf':
+            return TfidfTransformer(sublinear_tf=True, use_idf=False)
+        elif self.vectorizer == 'bm25':
+            return BM25Transformer(dtype=self.dtype or np.float64)
+        elif self.vectorizer == 'tfig':
+            return TftsrTransformer(information_gain, sublinear_tf=True, dtype=self.dtype or np.float64)
+        elif self.vectorizer == 'tfchi2':
+            return TftsrTransformer(chi_square, sublinear_tf=True, dtype=self.dtype or np.float64)
+        elif self.vectorizer == 'tfgr':
+            return TftsrTransformer(gain_ratio, sublinear_tf=True, dtype=self.dtype or np.float64)
+        elif self.vectorizer == 'tfrf':
+            return TftsrTransformer(relevance_frequency, sublinear_tf=True, dtype=self.dtype or np.float64)
+        elif self.vectorizer == 'tfcw':
+            return TftsrTransformer(conf_weight, sublinear_tf=True, dtype=self.dtype or np.float64)
+
+    # Tokenizes the collection into raw term counts. Counts only depend on the collection, min_df, and stop_words, and
+    # are cached on disk (unless use_cache=False) so that all vectorizers (and all the categories of a collection) share
+    # the same tokenization
+    def _count_documents(self):
+        counts_path = self._counts_cache_path()
+        if counts_path is not None and os.path.exists(counts_path):
+            counts = pickle.load(open(counts_path, 'rb'))
+        else:
+            vectorizer = CountVectorizer(stop_words=self.stop_words, min_df=self.min_df)
+            counts = {'devel': vectorizer.fit_transform(self.devel.data), 'vocabulary': vectorizer.vocabulary_}
+            if counts_path is not None and not self._appended:
+                pickle_atomic(counts, counts_path)
+        return counts['devel'], counts['vocabulary']
+
+    # the test counts are computed (and cached) separately, with the vocabulary of the devel counts
+    def _count_test_documents(self, documents):
+        counts_path = self._counts_cache_path('.test')
+        if counts_path is not None and os.path.exists(counts_path):
+            return pickle.load(open(counts_path, 'rb'))
+        test_counts = CountVectorizer(stop_words=self.stop_words, vocabulary=self._count_vocabulary).transform(documents)
+        if counts_path is not None and not self._appended:
+            pickle_atomic(test_counts, counts_path)
+        return test_counts
+
+    # None if caching is disabled
+    def _counts_cache_path(self, subset=''):
+        if not self._use_cache: return None
+        key = (self.name, self.min_df, self.stop_words, TextCollectionLoader.version)
+        cache_dir = self._vectorized_cache_dir(self._cache_dir)
+        return os.path.join(cache_dir, '%s.counts.%s%s.pickle' % (self.name, hashlib.md5(str(key)).hexdigest(), subset))
 
     def train_batch(self, batch_size=64):
         if self.offset == 0 and self.epoch == 0: random.shuffle(self.train_indexes)
@@ -202,17 +668,47 @@ class TextCollectionLoader:
             random.shuffle(self.train_indexes)
         return batch_rep, labels
 
+    # iterator of training batches (as returned by train_batch) prepared in a background thread, keeping up to
+    # 'prefetch' batches ready; the iterator should be closed once the training is over
+    def train_batch_iterator(self, batch_size=64, prefetch=2):
+        return BatchPrefetcher(self, batch_size=batch_size, prefetch=prefetch)
+
     #virtually remove invalid documents (documents without any non-zero feature)
     def _get_doc_indexes(self, vector_set):
-        all_indexes = np.arange(vector_set.shape[0])
-        return [i for i in all_indexes if vector_set[i].nnz>0]
+        if isinstance(vector_set, ShardedMatrix):
+            nnz_by_row = vector_set.row_nnz()
+        else:
+            nnz_by_row = np.diff(vector_set.tocsr().indptr)
+        return np.flatnonzero(nnz_by_row > 0).tolist()
 
+    # row indices (as a column vector) and feature ids of the stored entries of the batch, taken directly from the
+    # indptr and indices arrays of the csr representation (in the same order as batch.data)
     def get_index_values(self, batch):
-        num_indices = len(batch.nonzero()[0])
-        indices = batch.nonzero()[0].reshape(num_indices, 1)
-        values = batch.nonzero()[1]
+        batch = csr_matrix(batch)
+        lengths = np.diff(batch.indptr)
+        indices = np.repeat(np.arange(batch.shape[0], dtype=np.int32), lengths).reshape(-1, 1)
+        values = batch.indices.astype(np.int32, copy=False)
         return indices, values
 
+    # nD x L int32 matrix of feature ids, where L is the number of features of the longest document in the batch, the
+    # corresponding nD x L matrix of weights (None if the vectorizer is not weighted), and the int32 vector with the
+    # number of features of each document; the padding positions have feature id 0 and weight 0. The shapes only depend
+    # on the batch (L is 0 if the batch has no features at all)
+    def get_padded_index_values(self, batch):
+        batch = csr_matrix(batch)
+        nD = batch.shape[0]
+        lengths = np.diff(batch.indptr).astype(np.int32)
+        width = lengths.max() if nD > 0 else 0
+        rows = np.repeat(np.arange(nD), lengths)
+        positions = np.arange(batch.nnz) - np.repeat(batch.indptr[:-1], lengths)
+        ids = np.zeros((nD, width), dtype=np.int32)
+        ids[rows, positions] = batch.indices
+        weights = None
+        if self.weight_getter != self._get_none:
+            weights = np.zeros((nD, width), dtype=batch.dtype)
+            weights[rows, positions] = self.weight_getter(batch)
+        return ids, weights, lengths
+
     def _get_none(self, batch):
         return []
 
@@ -227,15 +723,22 @@ class TextCollectionLoader:
         weights = self.weight_getter(batch)
         return indices, values, weights
 
+    def _padded_index_batch_getter(self, batch):
+        return self.get_padded_index_values(batch)
+
     def _dense_batch_getter(self, batch):
-        return batch
+        return batch.todense()
 
     def _null_batch_getter(self, batch):
         indices, values = self.get_index_values(batch)
         weights = self.weight_getter(batch)
         return indices, values, weights
 
+    # in out-of-core mode, the set is returned as a lazy ShardedMatrix restricted to indexes, which is to be traversed
+    # with iter_blocks (the batch representation can then be obtained for each block with _batch_getter)
     def __get_set(self, vec_set, target, indexes):
+        if isinstance(vec_set, ShardedMatrix):
+            return vec_set.select_rows(indexes), target[indexes]
         repr = self._batch_getter(vec_set[indexes])
         labels = target[indexes]
         return repr, labels
@@ -261,8 +764,7 @@ class TextCollectionLoader:
     def feature_label_contingency_table(self, feat_index, cat_label=1):
         feat_vec = self.devel_vec[:,feat_index] #TODO: cache also the feature-vectors
         if cat_label not in self.cat_vec_dic:
-            binary_target = self.binarize_label_vector(self.devel.target, self.classification, cat_label)
-            self.cat_vec_dic[cat_label] = set([i for i, label in enumerate(binary_target) if label == 1])
+            self.cat_vec_dic[cat_label] = set(self.devel_labels.positives(cat_label).tolist())
         feat_doc_set = set(feat_vec.nonzero()[0])
         return feature_label_contingency_table(self.cat_vec_dic[cat_label], feat_doc_set, self.num_devel_docs())
 
@@ -270,7 +772,7 @@ class TextCollectionLoader:
         return len(self.devel_indexes)
 
     def num_categories(self):
-        return len(np.unique(self.devel.target))
+        return self.devel_labels.num_categories()
 
     def num_features(self):
         return self.devel_vec.shape[1]
@@ -289,54 +791,59 @@ class TextCollectionLoader:
 
     def get_4cell_matrix(self):
         if self.supervised_4cell_matrix is None:
-            devel_occ, devel_target = self.get_devel_set()
-            if len(devel_target.shape)==1:
-                devel_target = devel_target.reshape(-1,1)
-            self.supervised_4cell_matrix = get_supervised_matrix(devel_occ, devel_target)
+            # the sparse matrix is used directly, regardless of the rep_mode of the batches
+            if self.classification in ['binary', 'polarity']:
+                devel_target = self.devel_labels.submatrix(self.devel_indexes, columns=[1]) # the positive class only
+            else:
+                devel_target = self.devel_labels.submatrix(self.devel_indexes)
+            if isinstance(self.devel_vec, ShardedMatrix):
+                devel_blocks = self.devel_vec.select_rows(self.devel_indexes).iter_blocks()
+                self.supervised_4cell_matrix = get_supervised_matrix_from_blocks(devel_blocks, devel_target)
+            else:
+                devel_occ = self.devel_vec[self.devel_indexes]
+                self.supervised_4cell_matrix = get_supervised_matrix(devel_occ, devel_target)
         return self.supervised_4cell_matrix
 
+    def __open_text_store(self, path):
+        data, target, target_names = open_text_store(path)
+        return Dataset(data=data, target=target, target_names=target_names)
+
     def fetch_20newsgroups(self, data_path=None, subset='train'):
         if data_path is None:
             data_path = os.path.join(get_data_home(), '20newsgroups')
             create_if_not_exists(data_path)
-        _20news_pickle_path = os.path.join(data_path, "20newsgroups." + subset + ".pickle")
-        if not os.path.exists(_20news_pickle_path):
+        _20news_store_path = os.path.join(data_path, "20newsgroups." + subset)
+        if not text_store_exists(_20news_store_path):
+            from sklearn.datasets import fetch_20newsgroups
             metadata = ('headers', 'footers', 'quotes')
             dataset = fetch_20newsgroups(subset=subset, remove=metadata)
-            pickle.dump(dataset, open(_20news_pickle_path, 'wb'), protocol=pickle.HIGHEST_PROTOCOL)
-        else:
-            dataset = pickle.load(open(_20news_pickle_path, 'rb'))
-        return dataset
+            write_text_store(_20news_store_path, dataset.data, dataset.target, dataset.target_names)
+        return self.__open_text_store(_20news_store_path)
 
     def fetch_reuters21579(self, data_path=None, subset='train'):
         if data_path is None:
             data_path = os.path.join(get_data_home(), 'reuters')
-        reuters_pickle_path = os.path.join(data_path, "reuters." + subset + ".pickle")
-        if not os.path.exists(reuters_pickle_path):
-            parser = ReutersParser()
-            for filename in glob(os.path.join(data_path, "*.sgm")):
-                parser.parse(open(filename, 'rb'))
+        reuters_store_path = os.path.join(data_path, "reuters." + subset)
+        if not text_store_exists(reuters_store_path):
+            from reuters21578_parser import stream_reuters_documents
+            docs = {'train': [], 'test': []}
+            stats = {'empty_docs': 0}
+            for doc_subset, doc in stream_reuters_documents(data_path, stats=stats):
+                docs[doc_subset].append(doc)
             # index category names with a unique numerical code (only considering categories with training examples)
-            tr_categories = np.unique(np.concatenate([doc['topics'] for doc in parser.tr_docs])).tolist()
-
-            def pickle_documents(docs, subset):
-                for doc in docs:
-                    doc['topics'] = [tr_categories.index(t) for t in doc['topics'] if t in tr_categories]
-                pickle_docs = {'categories': tr_categories, 'documents': docs}
-                pickle.dump(pickle_docs, open(os.path.join(data_path, "reuters." + subset + ".pickle"), 'wb'),
-                            protocol=pickle.HIGHEST_PROTOCOL)
-                return pickle_docs
-
-            pickle_tr = pickle_documents(parser.tr_docs, "train")
-            pickle_te = pickle_documents(parser.te_docs, "test")
-            print('Empty docs %d' % parser.empty_docs)
-            requested_subset = pickle_tr if subset == 'train' else pickle_te
-        else:
-            requested_subset = pickle.load(open(reuters_pickle_path, 'rb'))
+            tr_categories = np.unique(np.concatenate([doc['topics'] for doc in docs['train']])).tolist()
+            cat_index = dict((cat, i) for i, cat in enumerate(tr_categories))
 
-        data = [(u'{title}\n{body}\n{unproc}'.format(**doc), doc['topics']) for doc in requested_subset['documents']]
-        text_data, topics = zip(*data)
-        return Dataset(data=text_data, target=topics, target_names=requested_subset['categories'])
+            def store_documents(docs, subset):
+                text_data = [u'{title}\n{body}\n{unproc}'.format(**doc) for doc in docs]
+                topics = [[cat_index[t] for t in doc['topics'] if t in cat_index] for doc in docs]
+                write_text_store(os.path.join(data_path, "reuters." + subset), text_data, topics, tr_categories)
+
+            store_documents(docs['train'], "train")
+            store_documents(docs['test'], "test")
+            print('Empty docs %d' % stats['empty_docs'])
+
+        return self.__open_text_store(reuters_store_path)
 
     def fetch_ohsumed20k(self, data_path=None, subset='train'):
         _dataname = 'ohsumed_20k'
@@ -344,8 +851,9 @@ class TextCollectionLoader:
             data_path = join(os.path.expanduser('~'), _dataname)
         create_if_not_exists(data_path)
 
-        pickle_file = join(data_path, _dataname + '.' + subset + '.pickle')
-        if not os.path.exists(pickle_file):
+        store_path = join(data_path, _dataname + '.' + subset)
+        if not text_store_exists(store_path):
+            from sklearn.externals.six.moves import urllib
             DOWNLOAD_URL = ('http://disi.unitn.it/moschitti/corpora/ohsumed-first-20000-docs.tar.gz')
             archive_path = os.path.join(data_path, 'ohsumed-first-20000-docs.tar.gz')
             if not os.path.exists(archive_path):
@@ -360,24 +868,26 @@ class TextCollectionLoader:
             classification = dict()
             content = dict()
             for split in ['training', 'test']:
+                doc_paths = OrderedDict() # the first path in which each new document is found
                 for cat_id in os.listdir(join(data_path, untardir, split)):
                     if cat_id not in target_names: target_names.append(cat_id)
                     for doc_id in os.listdir(join(data_path, untardir, split, cat_id)):
-                        text_content = open(join(data_path, untardir, split, cat_id, doc_id), 'r').read()
                         if doc_id not in classification: classification[doc_id] = []
                         splitdata[split].add(doc_id)
                         classification[doc_id].append(cat_id)
-                        if doc_id not in content: content[doc_id] = text_content
+                        if doc_id not in content and doc_id not in doc_paths:
+                            doc_paths[doc_id] = join(data_path, untardir, split, cat_id, doc_id)
+                content.update(zip(doc_paths.keys(), read_files(doc_paths.values())))
                 target_names.sort()
+                cat_index = dict((cat_id, i) for i, cat_id in enumerate(target_names))
                 dataset = Dataset([], [], target_names)
                 for doc_id in splitdata[split]:
                     dataset.data.append(content[doc_id])
-                    dataset.target.append([target_names.index(cat_id) for cat_id in classification[doc_id]])
+                    dataset.target.append([cat_index[cat_id] for cat_id in classification[doc_id]])
                 splitname = 'train' if split == 'training' else 'test'
-                pickle.dump(dataset, open(join(data_path, _dataname + '.' + splitname + '.pickle'), 'wb'),
-                            protocol=pickle.HIGHEST_PROTOCOL)
+                self.__store_dataset(dataset, join(data_path, _dataname + '.' + splitname), encoding='latin-1')
 
-        return pickle.load(open(pickle_file, 'rb'))
+        return self.__open_text_store(store_path)
 
     def fetch_ohsumed50k(self, data_path=None, subset='train', train_test_split=0.7):
         _dataname = 'ohsumed_50k'
@@ -385,8 +895,9 @@ class TextCollectionLoader:
             data_path = join(os.path.expanduser('~'), _dataname)
         create_if_not_exists(data_path)
 
-        pickle_file = join(data_path, _dataname + '.' + subset + str(train_test_split) + '.pickle')
-        if not os.path.exists(pickle_file):
+        store_path = join(data_path, _dataname + '.' + subset + str(train_test_split))
+        if not text_store_exists(store_path):
+            from sklearn.externals.six.moves import urllib
             DOWNLOAD_URL = ('http://disi.unitn.it/moschitti/corpora/ohsumed-all-docs.tar.gz')
             archive_path = os.path.join(data_path, 'ohsumed-all-docs.tar.gz')
             if not os.path.exists(archive_path):
@@ -401,37 +912,38 @@ class TextCollectionLoader:
             target_names = []
             doc_classes = dict()
             class_docs = dict()
-            content = dict()
-            doc_ids = set()
+            doc_paths = OrderedDict() # the first path in which each document is found
             for cat_id in os.listdir(join(data_path, untardir)):
                 target_names.append(cat_id)
                 class_docs[cat_id] = []
                 for doc_id in os.listdir(join(data_path, untardir, cat_id)):
-                    doc_ids.add(doc_id)
-                    text_content = open(join(data_path, untardir, cat_id, doc_id), 'r').read()
-                    if doc_id not in doc_classes: doc_classes[doc_id] = []
+                    if doc_id not in doc_classes:
+                        doc_classes[doc_id] = []
+                        doc_paths[doc_id] = join(data_path, untardir, cat_id, doc_id)
                     doc_classes[doc_id].append(cat_id)
-                    if doc_id not in content: content[doc_id] = text_content
                     class_docs[cat_id].append(doc_id)
             target_names.sort()
-            print('Read %d different documents' % len(doc_ids))
+            content = dict(zip(doc_paths.keys(), read_files(doc_paths.values())))
+            print('Read %d different documents' % len(content))
 
             splitdata = dict({'train':[], 'test':[]})
+            assigned = set()
             for cat_id in target_names:
-                free_docs = [d for d in class_docs[cat_id] if (d not in splitdata['train'] and d not in splitdata['test'])]
+                free_docs = [d for d in class_docs[cat_id] if d not in assigned]
                 if len(free_docs) > 0:
                     split_point = int(math.floor(len(free_docs)*train_test_split))
                     splitdata['train'].extend(free_docs[:split_point])
                     splitdata['test'].extend(free_docs[split_point:])
+                    assigned.update(free_docs)
+            cat_index = dict((cat_id, i) for i, cat_id in enumerate(target_names))
             for split in ['train', 'test']:
                 dataset = Dataset([], [], target_names)
                 for doc_id in splitdata[split]:
                     dataset.data.append(content[doc_id])
-                    dataset.target.append([target_names.index(cat_id) for cat_id in doc_classes[doc_id]])
-                pickle.dump(dataset, open(join(data_path, _dataname + '.' + split + str(train_test_split) + '.pickle'), 'wb'),
-                            protocol=pickle.HIGHEST_PROTOCOL)
+                    dataset.target.append([cat_index[cat_id] for cat_id in doc_classes[doc_id]])
+                self.__store_dataset(dataset, join(data_path, _dataname + '.' + split + str(train_test_split)), encoding='latin-1')
 
-        return pickle.load(open(pickle_file, 'rb'))
+        return self.__open_text_store(store_path)
 
 
     def __distribute_evenly(self, pos_docs, neg_docs, target_names):
@@ -453,29 +965,31 @@ class TextCollectionLoader:
         test = self.__distribute_evenly(te_pos, te_neg, target_names)
         return train, test
 
-    def __pickle_dataset(self, train, test, path, name, posfix=''):
-        pickle.dump(train, open(join(path, name+'.train' + posfix + '.pickle'), 'wb'), protocol=pickle.HIGHEST_PROTOCOL)
-        pickle.dump(test, open(join(path, name+'.test' + posfix + '.pickle'), 'wb'), protocol=pickle.HIGHEST_PROTOCOL)
+    # encoding is the one of the source files, from which the documents were read as byte-strings
+    def __store_dataset(self, dataset, path, encoding='utf-8'):
+        write_text_store(path, dataset.data, dataset.target, dataset.target_names, encoding=encoding)
+
+    def __store_train_test(self, train, test, path, name, posfix=''):
+        self.__store_dataset(train, join(path, name + '.train' + posfix))
+        self.__store_dataset(test, join(path, name + '.test' + posfix))
 
     def fetch_movie_reviews(self, subset='train', data_path=None, train_test_split=0.7):
+        import nltk
         if data_path is None:
             data_path = join(nltk.data.path[0], 'corpora')
 
         _posfix=str(train_test_split)
         _dataname='movie_reviews'
-        moviereviews_pickle_path = os.path.join(data_path, _dataname + '.' + subset + _posfix + '.pickle')
-        if not os.path.exists(moviereviews_pickle_path):
+        moviereviews_store_path = os.path.join(data_path, _dataname + '.' + subset + _posfix)
+        if not text_store_exists(moviereviews_store_path):
+            from nltk.corpus import movie_reviews
             documents = dict([(cat, []) for cat in ['neg', 'pos']])
             [documents[i.split('/')[0]].append(' '.join([w for w in movie_reviews.words(i)])) for i in movie_reviews.fileids()]
 
             train, test = self.__process_posneg_dataset(pos_docs=documents['pos'], neg_docs=documents['neg'], train_test_split=train_test_split)
-            self.__pickle_dataset(train, test, data_path,_dataname,_posfix)
+            self.__store_train_test(train, test, data_path,_dataname,_posfix)
 
-            #debug esto
-
-            return train if subset == 'train' else test
-        else:
-            return pickle.load(open(moviereviews_pickle_path, 'rb'))
+        return self.__open_text_store(moviereviews_store_path)
 
     def fetch_sentence_polarity(self, subset='train', data_path=None, train_test_split=0.7):
         if data_path is None:
@@ -484,9 +998,10 @@ class TextCollectionLoader:
 
         _posfix=str(train_test_split)
         _dataname='sentence_polarity'
-        sentpolarity_pickle_path = join(data_path, _dataname + '.' + subset + _posfix + '.pickle')
+        sentpolarity_store_path = join(data_path, _dataname + '.' + subset + _posfix)
 
-        if not os.path.exists(sentpolarity_pickle_path):
+        if not text_store_exists(sentpolarity_store_path):
+            from sklearn.externals.six.moves import urllib
             DOWNLOAD_URL = ('https://www.cs.cornell.edu/people/pabo/movie-review-data/rt-polaritydata.tar.gz')
             archive_path = os.path.join(data_path, 'rt-polaritydata.tar.gz')
             print("downloading file...")
@@ -496,11 +1011,9 @@ class TextCollectionLoader:
             positive_sentences = [unicode(s, 'ISO-8859-1') for s in open(os.path.join(data_path, 'rt-polaritydata', 'rt-polarity.pos'), 'r')]
             negative_sentences = [unicode(s, 'ISO-8859-1') for s in open(os.path.join(data_path, 'rt-polaritydata', 'rt-polarity.neg'), 'r')]
             train, test = self.__process_posneg_dataset(positive_sentences, negative_sentences, train_test_split)
-            self.__pickle_dataset(train, test, data_path, _dataname, _posfix)
+            self.__store_train_test(train, test, data_path, _dataname, _posfix)
 
-            return train if subset == 'train' else test
-        else:
-            return pickle.load(open(sentpolarity_pickle_path, 'rb'))
+        return self.__open_text_store(sentpolarity_store_path)
 
     def fetch_IMDB(self, subset='train', data_path=None):
         if data_path is None:
@@ -508,8 +1021,9 @@ class TextCollectionLoader:
         create_if_not_exists(data_path)
 
         _dataname = 'imdb'
-        imdb_pickle_file = join(data_path, _dataname+'.'+subset+'.pickle')
-        if not os.path.exists(imdb_pickle_file):
+        imdb_store_path = join(data_path, _dataname+'.'+subset)
+        if not text_store_exists(imdb_store_path):
+            from sklearn.externals.six.moves import urllib
             DOWNLOAD_URL = ('http://ai.stanford.edu/~amaas/data/sentiment/aclImdb_v1.tar.gz')
             archive_path = os.path.join(data_path, 'aclImdb_v1.tar.gz')
             if not os.path.exists(archive_path):
@@ -524,20 +1038,15 @@ class TextCollectionLoader:
                 for polarity in ['pos', 'neg']:
                     if polarity not in data[split]: data[split][polarity] = []
                     reviews_path = join(data_path,'aclImdb',split,polarity)
-                    for review in listdir(reviews_path):
-                        review_txt = open(join(reviews_path, review),'r').read()
-                        data[split][polarity].append(review_txt)
+                    data[split][polarity].extend(read_files([join(reviews_path, review) for review in listdir(reviews_path)]))
 
             target_names = ['negative', 'positive']
 
             train = self.__distribute_evenly(data['train']['pos'], data['train']['neg'], target_names)
             test = self.__distribute_evenly(data['test']['pos'], data['test']['neg'], target_names)
-            self.__pickle_dataset(train, test, data_path, _dataname)
+            self.__store_train_test(train, test, data_path, _dataname)
 
-            return train if subset=='train' else test
-
-        else:
-            return pickle.load(open(imdb_pickle_file, 'rb'))
+        return self.__open_text_store(imdb_store_path)
 
 
 class TftsrVectorizer:
@@ -545,32 +1054,14 @@ class TftsrVectorizer:
         self.stop_words = stop_words
         self.sublinear_tf = sublinear_tf
         self.tsr_function = tsr_function
-        self.cat_doc_set = set([i for i, label in enumerate(binary_target) if label == 1])
-        self.supervised_info = None
+        self.binary_target = binary_target
         self.min_df = min_df
 
     def fit_transform(self, raw_documents):
-        self.vectorizer = TfidfVectorizer(stop_words=self.stop_words, sublinear_tf=self.sublinear_tf, use_idf=False, min_df=self.min_df)
-        self.devel_vec = self.vectorizer.fit_transform(raw_documents)
-        #return self.devel_vec
-        #print self.devel_vec.shape
-        return self.supervised_weighting(self.devel_vec)
+        self.vectorizer = CountVectorizer(stop_words=self.stop_words, min_df=self.min_df)
+        self.transformer = TftsrTransformer(self.tsr_function, sublinear_tf=self.sublinear_tf)
+        return self.transformer.fit_transform(self.vectorizer.fit_transform(raw_documents), self.binary_target)
 
     def transform(self, raw_documents):
         if not hasattr(self, 'vectorizer'): raise NameError('TftsrVectorizer: transform method called before fit.')
-        transformed = self.vectorizer.transform(raw_documents)
-        return self.supervised_weighting(transformed)
-        #return transformed
-
-    def supervised_weighting(self, w):
-        w = w.toarray()
-        num_cores = multiprocessing.cpu_count()
-        nD, nF = w.shape
-        if self.supervised_info is None:
-            #sup = [wrap_contingency_table(f,self.devel_vec, self.cat_doc_set, nD) for f in range(nF)]
-            sup = Parallel(n_jobs=num_cores, backend="threading")(
-                delayed(wrap_contingency_table)(f, self.devel_vec, self.cat_doc_set, nD) for f in range(nF))
-            self.supervised_info = np.array([self.tsr_function(sup_i) for sup_i in sup])
-        sup_w = np.multiply(w, self.supervised_info)
-        sup_w = sklearn.preprocessing.normalize(sup_w, norm='l2', axis=1, copy=False)
-        return scipy.sparse.csr_matrix(sup_w)
+        return self.transformer.transform(self.vectorizer.transform(raw_documents))
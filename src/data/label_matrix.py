@@ -0,0 +1,82 @@
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from text_store import _is_multilabel
+
+
+class LabelMatrix:
+    """
+    Sparse nD x nC indicator matrix of the labels of a document collection, built once from the target, being it a
+    vector of category codes (single-label, binary, and polarity collections) or a list of lists of category codes
+    (multi-label collections). The positive documents and prevalence of each category are cached on demand.
+    """
+
+    def __init__(self, target, nC=None):
+        if _is_multilabel(target):
+            codes = np.array([code for doc_labels in target for code in doc_labels], dtype=int)
+            indptr = np.cumsum([0] + [len(doc_labels) for doc_labels in target])
+        else:
+            codes = np.asarray(target, dtype=int).reshape(-1)
+            indptr = np.arange(len(codes) + 1)
+        nD = len(indptr) - 1
+        if nC is None or (len(codes) > 0 and codes.max() >= nC):
+            nC = codes.max() + 1 if len(codes) > 0 else 0
+        matrix = csr_matrix((np.ones(len(codes), dtype=int), codes, indptr), shape=(nD, nC))
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        self._set_matrix(matrix)
+
+    def _set_matrix(self, matrix):
+        self.matrix = matrix
+        self._by_category = self.matrix.tocsc()
+        self._by_category.sort_indices()
+        self._positives = dict()
+        self._indicators = dict()
+
+    # appends the labels of new documents (coded as the target of the constructor) as new rows of the matrix
+    def append(self, target):
+        new = LabelMatrix(target, self.matrix.shape[1]).matrix
+        nD, nC = self.num_documents(), new.shape[1] # new categories, if any, are added as new columns
+        matrix = csr_matrix((self.matrix.data, self.matrix.indices, self.matrix.indptr), shape=(nD, nC))
+        self._set_matrix(vstack([matrix, new], format='csr'))
+
+    def num_documents(self):
+        return self.matrix.shape[0]
+
+    # number of categories with at least one document
+    def num_categories(self):
+        return np.count_nonzero(np.diff(self._by_category.indptr))
+
+    # sorted array of indexes of the documents labelled with category c (empty if c is None)
+    def positives(self, c):
+        if c not in self._positives:
+            indptr = self._by_category.indptr
+            if c is None:
+                self._positives[c] = self._by_category.indices[:0]
+            else:
+                self._positives[c] = self._by_category.indices[indptr[c]:indptr[c + 1]]
+        return self._positives[c]
+
+    # boolean vector (of length nD) indicating the documents labelled with category c
+    def indicator(self, c):
+        if c not in self._indicators:
+            indicator = np.zeros(self.num_documents(), dtype=bool)
+            indicator[self.positives(c)] = True
+            self._indicators[c] = indicator
+        return self._indicators[c]
+
+    # 0/1 vector with positive class = 1 for category c, and all others = 0
+    def binary_vector(self, c):
+        return self.indicator(c).astype(int)
+
+    # proportion of documents labelled with category c, among those indicated in rows (or all of them if None)
+    def prevalence(self, c, rows=None):
+        if rows is None:
+            return len(self.positives(c)) * 1.0 / self.num_documents()
+        return np.count_nonzero(self.indicator(c)[rows]) * 1.0 / len(rows)
+
+    # sparse sub-matrix of the label matrix with the indicated rows (documents) and columns (categories)
+    def submatrix(self, rows=None, columns=None):
+        sub = self.matrix
+        if rows is not None: sub = sub[rows]
+        if columns is not None: sub = sub[:, columns]
+        return sub
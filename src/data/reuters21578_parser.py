@@ -4,9 +4,11 @@
 
 from __future__ import print_function
 
+import multiprocessing
 import os.path
 import re
 import tarfile
+from glob import glob
 
 from sklearn.datasets import get_data_home
 from sklearn.externals.six.moves import html_parser
@@ -21,23 +23,31 @@ def _not_in_sphinx():
 class ReutersParser(html_parser.HTMLParser):
     """Utility class to parse a SGML file and yield documents one at a time."""
 
-    def __init__(self, encoding='latin-1', data_path=None):
+    def __init__(self, encoding='latin-1', data_path=None, download=True):
         self.data_path = data_path
-        self.download_if_not_exist()
+        if download:
+            self.download_if_not_exist()
         self.tr_docs = []
         self.te_docs = []
         html_parser.HTMLParser.__init__(self)
         self._reset()
         self.encoding = encoding
         self.empty_docs = 0
+        # tag dispatch tables (resolved once instead of one getattr per tag)
+        self._start_handlers = {'reuters': self.start_reuters, 'title': self.start_title, 'body': self.start_body,
+                                'topics': self.start_topics, 'text': self.start_text, 'd': self.start_d}
+        self._end_handlers = {'reuters': self.end_reuters, 'title': self.end_title, 'body': self.end_body,
+                              'topics': self.end_topics, 'text': self.end_text, 'd': self.end_d}
 
     def handle_starttag(self, tag, attrs):
-        method = 'start_' + tag
-        getattr(self, method, lambda x: None)(attrs)
+        handler = self._start_handlers.get(tag)
+        if handler is not None:
+            handler(attrs)
 
     def handle_endtag(self, tag):
-        method = 'end_' + tag
-        getattr(self, method, lambda: None)()
+        handler = self._end_handlers.get(tag)
+        if handler is not None:
+            handler()
 
     def _reset(self):
         self.in_title = 0
@@ -124,29 +134,67 @@ class ReutersParser(html_parser.HTMLParser):
         self.topic_d = ""
 
     def download_if_not_exist(self):
-        DOWNLOAD_URL = ('http://archive.ics.uci.edu/ml/machine-learning-databases/'
-                        'reuters21578-mld/reuters21578.tar.gz')
-        ARCHIVE_FILENAME = 'reuters21578.tar.gz'
-
-        if self.data_path is None:
-            self.data_path = os.path.join(get_data_home(), "reuters")
-        if not os.path.exists(self.data_path):
-            """Download the dataset."""
-            print("downloading dataset (once and for all) into %s" % self.data_path)
-            os.mkdir(self.data_path)
-
-            def progress(blocknum, bs, size):
-                total_sz_mb = '%.2f MB' % (size / 1e6)
-                current_sz_mb = '%.2f MB' % ((blocknum * bs) / 1e6)
-                if _not_in_sphinx():
-                    print('\rdownloaded %s / %s' % (current_sz_mb, total_sz_mb), end='')
-
-            archive_path = os.path.join(self.data_path, ARCHIVE_FILENAME)
-            urllib.request.urlretrieve(DOWNLOAD_URL, filename=archive_path,
-                                       reporthook=progress)
-            if _not_in_sphinx():
-                print('\r', end='')
-            print("untarring Reuters dataset...")
-            tarfile.open(archive_path, 'r:gz').extractall(self.data_path)
-            print("done.")
+        self.data_path = download_reuters_if_not_exist(self.data_path)
+
+
+def download_reuters_if_not_exist(data_path=None):
+    DOWNLOAD_URL = ('http://archive.ics.uci.edu/ml/machine-learning-databases/'
+                    'reuters21578-mld/reuters21578.tar.gz')
+    ARCHIVE_FILENAME = 'reuters21578.tar.gz'
 
+    if data_path is None:
+        data_path = os.path.join(get_data_home(), "reuters")
+    if not os.path.exists(data_path):
+        """Download the dataset."""
+        print("downloading dataset (once and for all) into %s" % data_path)
+        os.mkdir(data_path)
+
+        def progress(blocknum, bs, size):
+            total_sz_mb = '%.2f MB' % (size / 1e6)
+            current_sz_mb = '%.2f MB' % ((blocknum * bs) / 1e6)
+            if _not_in_sphinx():
+                print('\rdownloaded %s / %s' % (current_sz_mb, total_sz_mb), end='')
+
+        archive_path = os.path.join(data_path, ARCHIVE_FILENAME)
+        urllib.request.urlretrieve(DOWNLOAD_URL, filename=archive_path,
+                                   reporthook=progress)
+        if _not_in_sphinx():
+            print('\r', end='')
+        print("untarring Reuters dataset...")
+        tarfile.open(archive_path, 'r:gz').extractall(data_path)
+        print("done.")
+    return data_path
+
+
+def _parse_sgm_file(args):
+    filename, encoding = args
+    parser = ReutersParser(encoding=encoding, data_path=os.path.dirname(filename), download=False)
+    parser.parse(open(filename, 'rb'))
+    return parser.tr_docs, parser.te_docs, parser.empty_docs
+
+
+def stream_reuters_documents(data_path=None, encoding='latin-1', n_jobs=-1, stats=None):
+    """
+    Parses the .sgm files of the collection in parallel worker processes (one file per task) and yields the documents
+    as a stream of (subset, document) pairs, with subset in {'train', 'test'}. Files are merged in the (sorted) order
+    of their names, and documents in their order within the file, so that the stream is deterministic regardless of
+    which worker finishes first.
+    :param stats: an optional dictionary in which the number of empty documents found by the workers is accumulated
+    (under the key 'empty_docs') as the stream is consumed
+    """
+    data_path = download_reuters_if_not_exist(data_path)
+    filenames = sorted(glob(os.path.join(data_path, "*.sgm")))
+    if not filenames: return
+    n_jobs = multiprocessing.cpu_count() if n_jobs == -1 else n_jobs
+    pool = multiprocessing.Pool(processes=min(n_jobs, len(filenames)))
+    try:
+        for tr_docs, te_docs, empty_docs in pool.imap(_parse_sgm_file, [(filename, encoding) for filename in filenames]):
+            if stats is not None:
+                stats['empty_docs'] = stats.get('empty_docs', 0) + empty_docs
+            for doc in tr_docs:
+                yield 'train', doc
+            for doc in te_docs:
+                yield 'test', doc
+        pool.close()
+    finally:
+        pool.terminate()
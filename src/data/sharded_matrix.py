@@ -0,0 +1,130 @@
+import cPickle as pickle
+import os
+from glob import glob
+from os.path import join
+
+import numpy as np
+import scipy.sparse as sp
+from utils.helpers import create_if_not_exists, pickle_atomic
+
+"""
+Out-of-core storage for sparse matrices larger than RAM. A matrix is stored in a directory as a sequence of CSR row
+shards, each one kept as three .npy arrays (data, indices, indptr) which are memory-mapped when read:
+    <path>/shard_<i>.data.npy, <path>/shard_<i>.indices.npy, <path>/shard_<i>.indptr.npy
+    <path>/meta.pickle    the shape of the matrix and the number of rows of each shard (written last, so that its
+                          presence signals a complete matrix)
+"""
+
+def sharded_matrix_exists(path):
+    return os.path.exists(join(path, 'meta.pickle'))
+
+
+class ShardedMatrixWriter:
+    """
+    Writes a ShardedMatrix one row-block (shard) at a time. A previous matrix in path is invalidated (its meta.pickle is
+    removed, along with its shards) before any shard is written, so that it is never mistaken for the new one.
+    """
+
+    def __init__(self, path, num_columns):
+        self.path = create_if_not_exists(path)
+        self.num_columns = num_columns
+        self.shard_rows = []
+        if sharded_matrix_exists(path):
+            os.remove(join(path, 'meta.pickle'))
+        for stale in glob(join(path, 'shard_*.npy')):
+            os.remove(stale)
+
+    def append(self, block):
+        block = sp.csr_matrix(block)
+        if block.shape[1] != self.num_columns:
+            raise ValueError('Shard with %d columns appended to a matrix with %d columns' % (block.shape[1], self.num_columns))
+        block.sort_indices()
+        prefix = join(self.path, 'shard_%d' % len(self.shard_rows))
+        np.save(prefix + '.data.npy', block.data)
+        np.save(prefix + '.indices.npy', block.indices)
+        np.save(prefix + '.indptr.npy', block.indptr)
+        self.shard_rows.append(block.shape[0])
+
+    def close(self):
+        meta = {'shape': (sum(self.shard_rows), self.num_columns), 'shard_rows': self.shard_rows}
+        pickle_atomic(meta, join(self.path, 'meta.pickle'))
+        return ShardedMatrix(self.path)
+
+
+class ShardedMatrix:
+    """
+    Read-only sparse matrix stored in CSR row shards on disk (see ShardedMatrixWriter). Rows can be selected (lazily,
+    with select_rows, or materialized into an in-memory csr_matrix, with indexing) and the matrix can be traversed
+    block by block with iter_blocks, so that only one shard needs to be paged in at a time.
+    """
+
+    def __init__(self, path, rows=None):
+        self.path = path
+        meta = pickle.load(open(join(path, 'meta.pickle'), 'rb'))
+        self._full_shape = meta['shape']
+        self._shard_offsets = np.cumsum([0] + meta['shard_rows'])
+        self._rows = None if rows is None else np.asarray(rows, dtype=int)  # global rows of the view, in order
+        self._cached = (None, None)
+
+    @property
+    def shape(self):
+        nR = self._full_shape[0] if self._rows is None else len(self._rows)
+        return (nR, self._full_shape[1])
+
+    def num_shards(self):
+        return len(self._shard_offsets) - 1
+
+    def shard(self, i):
+        if self._cached[0] != i:
+            prefix = join(self.path, 'shard_%d' % i)
+            data, indices, indptr = [np.load(prefix + part, mmap_mode='r') for part in ['.data.npy', '.indices.npy', '.indptr.npy']]
+            nR = self._shard_offsets[i + 1] - self._shard_offsets[i]
+            self._cached = (i, sp.csr_matrix((data, indices, indptr), shape=(nR, self._full_shape[1])))
+        return self._cached[1]
+
+    # returns a lazy view of the matrix restricted to (and ordered by) rows, which are relative to this matrix
+    def select_rows(self, rows):
+        rows = np.asarray(rows, dtype=int)
+        return ShardedMatrix(self.path, rows=rows if self._rows is None else self._rows[rows])
+
+    # splits the global rows into runs of consecutive positions falling in the same shard
+    def _runs(self, rows):
+        if len(rows) == 0: return []
+        shard_ids = np.searchsorted(self._shard_offsets, rows, side='right') - 1
+        breaks = np.flatnonzero(np.diff(shard_ids)) + 1
+        starts = np.concatenate(([0], breaks))
+        ends = np.concatenate((breaks, [len(rows)]))
+        return [(shard_ids[s], rows[s:e] - self._shard_offsets[shard_ids[s]]) for s, e in zip(starts, ends)]
+
+    def iter_blocks(self):
+        """
+        :return: a generator of (row_offset, block) pairs, where block is an in-memory csr_matrix with the rows
+        [row_offset, row_offset+block.shape[0]) of this matrix
+        """
+        if self._rows is None:
+            for i in range(self.num_shards()):
+                yield self._shard_offsets[i], sp.csr_matrix(self.shard(i), copy=True)
+        else:
+            row_offset = 0
+            for shard_id, local_rows in self._runs(self._rows):
+                yield row_offset, self.shard(shard_id)[local_rows]
+                row_offset += len(local_rows)
+
+    def __getitem__(self, rows):
+        if isinstance(rows, slice):
+            rows = np.arange(*rows.indices(self.shape[0]))
+        rows = np.atleast_1d(np.asarray(rows, dtype=int))
+        if self._rows is not None:
+            rows = self._rows[rows]
+        if len(rows) == 0:
+            return sp.csr_matrix((0, self.shape[1]), dtype=self.shard(0).dtype if self.num_shards() > 0 else np.float64)
+        return sp.vstack([self.shard(shard_id)[local_rows] for shard_id, local_rows in self._runs(rows)], format='csr')
+
+    # number of non-zero entries in each row
+    def row_nnz(self):
+        nnz = np.concatenate([np.diff(np.load(join(self.path, 'shard_%d.indptr.npy' % i), mmap_mode='r'))
+                              for i in range(self.num_shards())])
+        return nnz if self._rows is None else nnz[self._rows]
+
+    def tocsr(self):
+        return self[np.arange(self.shape[0])]
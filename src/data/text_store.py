@@ -0,0 +1,99 @@
+import cPickle as pickle
+import mmap
+import os
+
+import numpy as np
+
+"""
+Compact on-disk format for raw text collections. A subset of a collection is stored as:
+    <path>.text           all documents concatenated in one single UTF-8 blob
+    <path>.offsets.npy    nD+1 byte offsets; document i spans blob[offsets[i]:offsets[i+1]]
+    <path>.labels.npy     the category codes (one per document in single-label collections; all codes concatenated in
+                          multi-label collections, in which case <path>.label_offsets.npy delimits each document)
+    <path>.meta.pickle    the category names (written last, so that its presence signals a complete store)
+The blob is opened with mmap, so that documents are only read (and decoded) when accessed, and concurrent processes
+reading the same store share the page cache, instead of each one deserializing all documents into Python strings.
+"""
+
+def _utf8(doc, encoding):
+    if isinstance(doc, unicode):
+        return doc.encode('utf-8')
+    # byte-strings are decoded from the encoding of the source files and re-encoded, so that the blob is valid UTF-8
+    return doc.decode(encoding).encode('utf-8')
+
+def _is_multilabel(target):
+    return len(target) > 0 and isinstance(target[0], (list, tuple, np.ndarray))
+
+def text_store_exists(path):
+    return os.path.exists(path + '.meta.pickle')
+
+# encoding is the one of the byte-string documents in data (unicode documents are written as they are)
+def write_text_store(path, data, target, target_names, encoding='utf-8'):
+    if len(data) != len(target):
+        raise ValueError('Number of documents (%d) and labels (%d) is not consistent' % (len(data), len(target)))
+    offsets = np.zeros(len(data) + 1, dtype=np.int64)
+    with open(path + '.text', 'wb') as blob:
+        for i, doc in enumerate(data):
+            doc = _utf8(doc, encoding)
+            blob.write(doc)
+            offsets[i + 1] = offsets[i] + len(doc)
+    np.save(path + '.offsets.npy', offsets)
+    multilabel = _is_multilabel(target)
+    if multilabel:
+        label_offsets = np.cumsum([0] + [len(doc_labels) for doc_labels in target]).astype(np.int64)
+        labels = np.array([code for doc_labels in target for code in doc_labels], dtype=np.int64)
+        np.save(path + '.label_offsets.npy', label_offsets)
+    else:
+        labels = np.asarray(target, dtype=np.int64)
+    np.save(path + '.labels.npy', labels)
+    meta = {'target_names': list(target_names), 'multilabel': multilabel}
+    pickle.dump(meta, open(path + '.meta.pickle', 'wb'), protocol=pickle.HIGHEST_PROTOCOL)
+
+def open_text_store(path):
+    """
+    :param path: the path prefix of the store, as passed to write_text_store
+    :return: a tuple (documents, target, target_names) where documents is a lazy MmapDocuments sequence, and target is
+    either an array of category codes (single-label) or a list of lists of category codes (multi-label)
+    """
+    meta = pickle.load(open(path + '.meta.pickle', 'rb'))
+    documents = MmapDocuments(path + '.text', np.load(path + '.offsets.npy', mmap_mode='r'))
+    labels = np.load(path + '.labels.npy')
+    if meta['multilabel']:
+        label_offsets = np.load(path + '.label_offsets.npy')
+        target = [labels[label_offsets[i]:label_offsets[i + 1]].tolist() for i in range(len(label_offsets) - 1)]
+    else:
+        target = labels
+    return documents, target, meta['target_names']
+
+
+class MmapDocuments:
+    """Read-only sequence of documents backed by a memory-mapped UTF-8 blob; documents are decoded on access."""
+
+    def __init__(self, blob_path, offsets):
+        self.blob_path = blob_path
+        self._offsets = offsets
+        self._file = open(blob_path, 'rb')
+        # mmap can not map empty files
+        if os.path.getsize(blob_path) > 0:
+            self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._blob = ''
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(len(self)))]
+        if i < 0: i += len(self)
+        if i < 0 or i >= len(self): raise IndexError('document index out of range')
+        return self._blob[int(self._offsets[i]):int(self._offsets[i + 1])].decode('utf-8')
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._file.close()
@@ -2,21 +2,23 @@ import cPickle as pickle
 import os
 
 import numpy as np
-from scipy.sparse import csr_matrix, vstack
+from scipy.sparse import vstack
 
 from utils.helpers import create_if_not_exists
+from data.custom_vectorizers import as_dtype
 
 
 class WeightedVectors:
-    def __init__(self, vectorizer, from_dataset, from_category, trX, trY, vaX, vaY, teX, teY, run_params_dic=None):
+    # dtype (e.g., np.float32) sets the dtype of the stored vectors; if None, the one of the given matrices is kept
+    def __init__(self, vectorizer, from_dataset, from_category, trX, trY, vaX, vaY, teX, teY, run_params_dic=None, dtype=None):
         self.name = from_dataset
         self.positive_cat = from_category
         self.vectorizer = vectorizer
-        self.trX = csr_matrix(trX)
+        self.trX = as_dtype(trX, dtype)
         self.trY = trY
-        self.vaX = csr_matrix(vaX)
+        self.vaX = as_dtype(vaX, dtype)
         self.vaY = vaY
-        self.teX = csr_matrix(teX)
+        self.teX = as_dtype(teX, dtype)
         self.teY = teY
         self.run_params_dic = run_params_dic
 
@@ -6,6 +6,25 @@ import time
 from os.path import join
 import cPickle as pickle
 
+# Merges the rankings of features of each category (rows of the nC x nF tsr_matrix, from the highest score to the lowest,
+# ties broken by the highest feature index) by taking, in turns, the next feature of each category, and skipping the
+# features already ranked. The turns are the columns of the matrix of per-category rankings, so the merge amounts to
+# keeping the first occurrence of each feature in its transposed ravel. If k is given, only the k top-ranked features
+# are returned, and only the first turns needed to rank them are merged.
+def round_robin_rank(tsr_matrix, k=None):
+    nC, nF = tsr_matrix.shape
+    order = np.argsort(tsr_matrix, axis=1, kind='mergesort')[:, ::-1]
+    k = nF if k is None else min(k, nF)
+    turns = max(1, -(-k // max(nC, 1))) # ceil(k/nC), the turns needed if no feature were repeated
+    while True:
+        turns = min(turns, nF)
+        merged = order[:, :turns].T.ravel()
+        _, first = np.unique(merged, return_index=True)
+        if len(first) >= k or turns == nF:
+            return merged[np.sort(first)][:k]
+        turns *= 2
+
+# the features_rank needs to contain (at least) the k top-ranked features
 class FeatureSelectorFromRank:
     def __init__(self, k, features_rank):
         self._k=k
@@ -13,9 +32,8 @@ class FeatureSelectorFromRank:
 
     def fit(self, X, y=None):
         _, self.nF = X.shape
-        if len(self._features_rank) != self.nF: raise ValueError("Error: features rank incomplete")
-        self._k_best_feats = self._features_rank[:self._k]
-        self._k_best_feats.sort()
+        if len(self._features_rank) < min(self._k, self.nF): raise ValueError("Error: features rank incomplete")
+        self._k_best_feats = np.sort(self._features_rank[:self._k]) # a sorted copy; the rank is left untouched
 
     def transform(self, X):
         _,nF=X.shape
@@ -27,33 +45,26 @@ class FeatureSelectorFromRank:
         self.fit(X)
         return self.transform(X)
 
+# the supervised_4cell_matrix of X and y can be given (e.g., maintained with ContingencyCounts) to avoid recomputing it;
+# with full_rank=False the rank (_features_rank) is only computed up to the k-th feature
 class RoundRobin:
-    def __init__(self, k, score_func=information_gain, n_jobs=-1):
+    def __init__(self, k, score_func=information_gain, n_jobs=-1, supervised_4cell_matrix=None, full_rank=True):
         self._score_func = score_func
         self._k = k
         self.n_jobs=n_jobs
+        self._supervised_4cell_matrix = supervised_4cell_matrix
+        self.full_rank = full_rank
 
     def fit(self, X, y):
         nF = X.shape[1]
         nC = y.shape[1]
-        self.supervised_4cell_matrix = get_supervised_matrix(X, y, n_jobs=self.n_jobs)
+        if self._supervised_4cell_matrix is None:
+            self.supervised_4cell_matrix = get_supervised_matrix(X, y, n_jobs=self.n_jobs)
+        else:
+            if self._supervised_4cell_matrix.shape != (nC, nF): raise ValueError("Shape of supervised information matrix is inconsistent with X and y")
+            self.supervised_4cell_matrix = self._supervised_4cell_matrix
         tsr_matrix = get_tsr_matrix(self.supervised_4cell_matrix, self._score_func)
-
-        #enhance the tsr_matrix with the feature index
-        tsr_matrix = [[(tsr_matrix[c,f], f) for f in range(nF)] for c in range(nC)]
-        for c in range(nC):
-            tsr_matrix[c].sort(key=lambda x: x[0])
-
-        sel_feats = set()
-        self._features_rank = []
-        round = 0
-        #while len(sel_feats) < self._k:
-        while len(self._features_rank) < nF:
-            feature_index = tsr_matrix[round].pop()[1]
-            if feature_index not in sel_feats:
-                sel_feats.add(feature_index)
-                self._features_rank.append(feature_index)
-            round = (round+1) % nC
+        self._features_rank = round_robin_rank(tsr_matrix, None if self.full_rank else self._k)
 
         self.fs_rank = FeatureSelectorFromRank(k=self._k, features_rank=self._features_rank)
         self.fs_rank.fit(X,y)
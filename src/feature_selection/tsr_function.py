@@ -1,7 +1,5 @@
 import math
 import numpy as np
-from scipy.stats import t
-from scipy.stats import norm
 from joblib import Parallel, delayed
 import time
 from scipy.sparse import csr_matrix, csc_matrix
@@ -21,78 +19,118 @@ def apply_tsr(tpr, fpr, pc, tsr):
     cell = get_probs(tpr, fpr, pc)
     return tsr(cell)
 
+"""
+The tsr functions below are array-native: they take either a ContTable, returning the score of the category-feature
+pair as a float, or a ContingencyTensor, returning the nC x nF array with the scores of all pairs at once (the
+functions that support the latter are marked as vectorized, see get_tsr_matrix). Zero-probability cases (e.g., the log
+of a null probability) are resolved elementwise, as the scalar versions did.
+"""
+
+# float for a single table (0-dimensional result), or the array of scores otherwise
+def _result(score):
+    return float(score) if np.ndim(score) == 0 else score
+
+# elementwise log in base 2 (computed as math.log(x, 2) does), of the positive entries of x; the rest are set to 0
+def _log2(x):
+    x = np.asarray(x, dtype=float)
+    positive = x > 0
+    return np.where(positive, np.log(np.where(positive, x, 1.0)) / math.log(2), 0.0)
+
+def vectorized(tsr_function):
+    tsr_function.vectorized = True
+    return tsr_function
+
+@vectorized
 def positive_information_gain(cell):
-    if cell.tpr() < cell.fpr():
-        return 0.0
-    else:
-        return information_gain(cell)
+    return _result(np.where(cell.tpr() < cell.fpr(), 0.0, information_gain(cell)))
 
+@vectorized
 def posneg_information_gain(cell):
     ig = information_gain(cell)
-    if cell.tpr() < cell.fpr():
-        return -ig
-    else:
-        return ig
+    return _result(np.where(cell.tpr() < cell.fpr(), -ig, ig))
 
 def __ig_factor(p_tc, p_t, p_c):
-    den = p_t * p_c
-    if den != 0.0 and p_tc != 0:
-        return p_tc * math.log(p_tc / den, 2)
-    else:
-        return 0.0
+    den = np.asarray(p_t * p_c, dtype=float)
+    p_tc = np.asarray(p_tc, dtype=float)
+    defined = (den != 0.0) & (p_tc != 0)
+    return np.where(defined, p_tc * _log2(p_tc / np.where(defined, den, 1.0)), 0.0)
 
+@vectorized
 def information_gain(cell):
-    return __ig_factor(cell.p_tp(), cell.p_f(), cell.p_c()) + \
-           __ig_factor(cell.p_fp(), cell.p_f(), cell.p_not_c()) +\
-           __ig_factor(cell.p_fn(), cell.p_not_f(), cell.p_c()) + \
-           __ig_factor(cell.p_tn(), cell.p_not_f(), cell.p_not_c())
+    return _result(__ig_factor(cell.p_tp(), cell.p_f(), cell.p_c()) + \
+                   __ig_factor(cell.p_fp(), cell.p_f(), cell.p_not_c()) + \
+                   __ig_factor(cell.p_fn(), cell.p_not_f(), cell.p_c()) + \
+                   __ig_factor(cell.p_tn(), cell.p_not_f(), cell.p_not_c()))
 
+@vectorized
 def pointwise_mutual_information(cell):
-    return __ig_factor(cell.p_tp(), cell.p_f(), cell.p_c())
+    return _result(__ig_factor(cell.p_tp(), cell.p_f(), cell.p_c()))
 
+# the entropy of the category is 0 if all documents (or none) belong to it, in which case the gain ratio is set to 0
+@vectorized
 def gain_ratio(cell):
-    pc = cell.p_c()
+    pc = np.asarray(cell.p_c(), dtype=float)
     pnc = 1.0 - pc
-    norm = pc * math.log(pc, 2) + pnc * math.log(pnc, 2)
-    return information_gain(cell) / (-norm)
+    norm = pc * _log2(pc) + pnc * _log2(pnc)
+    return _result(np.where(norm != 0, information_gain(cell) / np.where(norm != 0, -norm, 1.0), 0.0))
 
+@vectorized
 def chi_square(cell):
-    den = cell.p_f() * cell.p_not_f() * cell.p_c() * cell.p_not_c()
-    if den==0.0: return 0.0
-    num = gss(cell)**2
-    return num / den
+    den = np.asarray(cell.p_f() * cell.p_not_f() * cell.p_c() * cell.p_not_c(), dtype=float)
+    num = np.asarray(gss(cell), dtype=float) ** 2
+    return _result(np.where(den != 0.0, num / np.where(den != 0.0, den, 1.0), 0.0))
 
+@vectorized
 def relevance_frequency(cell):
-    a = cell.tp
-    c = cell.fp
-    if c == 0: c = 1
-    return math.log(2.0 + (a * 1.0 / c), 2)
+    a = np.asarray(cell.tp, dtype=float)
+    c = np.asarray(cell.fp, dtype=float)
+    c = np.where(c == 0, 1.0, c)
+    return _result(_log2(2.0 + a / c))
 
+@vectorized
 def idf(cell):
-    if cell.p_f()>0:
-        return math.log(1.0 / cell.p_f())
-    return 0.0
+    p_f = np.asarray(cell.p_f(), dtype=float)
+    return _result(np.where(p_f > 0, np.log(1.0 / np.where(p_f > 0, p_f, 1.0)), 0.0))
 
+@vectorized
 def gss(cell):
-    return cell.p_tp()*cell.p_tn() - cell.p_fp()*cell.p_fn()
+    return _result(cell.p_tp()*cell.p_tn() - cell.p_fp()*cell.p_fn())
+
+_T_QUANTILES_SQUARED = None
 
+# squared 0.975-quantiles of the Student's t distribution with df=1..30 degrees of freedom (at position df-1), computed
+# once, on first use
+def _t_quantiles_squared():
+    global _T_QUANTILES_SQUARED
+    if _T_QUANTILES_SQUARED is None:
+        from scipy.stats import t # imported on demand, scipy.stats is slow to import
+        _T_QUANTILES_SQUARED = t.ppf(0.5 + 0.95 / 2.0, df=np.arange(1, 31)) ** 2
+    return _T_QUANTILES_SQUARED
+
+# elementwise confidence interval (center and amplitude) of the proportion xt/n; the t quantile of each (integer) n<=30
+# is taken from the table of _t_quantiles_squared
 def conf_interval(xt, n):
-    if n>30:
-        z2 = 3.84145882069 # norm.ppf(0.5+0.95/2.0)**2
-    else:
-        z2 = t.ppf(0.5 + 0.95 / 2.0, df=max(n-1,1)) ** 2
+    xt, n = np.broadcast_arrays(np.asarray(xt, dtype=float), np.asarray(n, dtype=float))
+    shape = n.shape
+    xt, n = xt.ravel(), n.ravel()
+    df = np.maximum(n - 1, 1)
+    small = n <= 30
+    in_table = small & (df == np.floor(df))
+    z2 = np.where(small, 0.0, 3.84145882069) # norm.ppf(0.5+0.95/2.0)**2
+    z2[in_table] = _t_quantiles_squared()[df[in_table].astype(int) - 1]
+    if np.any(small & ~in_table): # fractional counts (e.g., tables of probabilities)
+        from scipy.stats import t
+        z2[small & ~in_table] = t.ppf(0.5 + 0.95 / 2.0, df=df[small & ~in_table]) ** 2
     p = (xt + 0.5 * z2) / (n + z2)
-    amplitude = 0.5 * z2 * math.sqrt((p * (1.0 - p)) / (n + z2))
-    return p, amplitude
+    amplitude = 0.5 * z2 * np.sqrt((p * (1.0 - p)) / (n + z2))
+    return _result(p.reshape(shape)), _result(amplitude.reshape(shape))
 
 def strength(minPosRelFreq, minPos, maxNeg):
-    if minPos > maxNeg:
-        return math.log(2.0 * minPosRelFreq, 2.0)
-    else:
-        return 0.0
+    return _result(np.where(np.asarray(minPos) > maxNeg, _log2(2.0 * np.asarray(minPosRelFreq)), 0.0))
 
 #set cancel_features=True to allow some features to be weighted as 0 (as in the original article)
 #however, for some extremely imbalanced dataset caused all documents to be 0
+@vectorized
 def conf_weight(cell, cancel_features=False):
     c = cell.get_c()
     not_c = cell.get_not_c()
@@ -102,17 +140,17 @@ def conf_weight(cell, cancel_features=False):
     pos_p, pos_amp = conf_interval(tp, c)
     neg_p, neg_amp = conf_interval(fp, not_c)
 
-    min_pos = pos_p-pos_amp
-    max_neg = neg_p+neg_amp
+    min_pos = np.asarray(pos_p-pos_amp)
+    max_neg = np.asarray(neg_p+neg_amp)
     den = (min_pos + max_neg)
-    minpos_relfreq = min_pos / (den if den != 0 else 1)
+    minpos_relfreq = min_pos / np.where(den != 0, den, 1)
 
-    str_tplus = strength(minpos_relfreq, min_pos, max_neg);
+    str_tplus = np.asarray(strength(minpos_relfreq, min_pos, max_neg))
 
-    if str_tplus == 0 and not cancel_features:
-        return 1e-20
+    if not cancel_features:
+        str_tplus = np.where(str_tplus == 0, 1e-20, str_tplus)
 
-    return str_tplus;
+    return _result(str_tplus)
 
 class ContTable:
     def __init__(self, tp=0, tn=0, fp=0, fn=0):
@@ -121,6 +159,10 @@ class ContTable:
         self.fp=fp
         self.fn=fn
 
+    # the table of the union of two disjoint sets of documents
+    def __add__(self, other):
+        return ContTable(tp=self.tp+other.tp, tn=self.tn+other.tn, fp=self.fp+other.fp, fn=self.fn+other.fn)
+
     def get_d(self): return self.tp + self.tn + self.fp + self.fn
 
     def get_c(self): return self.tp + self.fn
@@ -156,6 +198,136 @@ class ContTable:
         return self.fp / _c if _c > 0.0 else 0.0
 
 
+class ContingencyTensor(object):
+    """
+    Structure-of-arrays version of the nC x nF matrix of ContTable objects: the four cells are kept in int arrays tp,
+    fp, fn, and tn of shape (nC, nF), and the counts, probabilities, and rates of ContTable are computed for all the
+    category-feature pairs at once (e.g., tensor.tpr() is the nC x nF matrix of true positive rates).
+    Indexing with a (category, feature) pair of integers returns the ContTable of the pair, while indexing with slices
+    or arrays of indexes (e.g., tensor[:, selected_features]) returns a sub-tensor, which is always 2-dimensional.
+    """
+    def __init__(self, tp, fp, fn, tn):
+        self.tp, self.fp, self.fn, self.tn = [np.atleast_2d(np.asarray(cell)) for cell in [tp, fp, fn, tn]]
+
+    @property
+    def shape(self):
+        return self.tp.shape
+
+    def __len__(self):
+        return self.tp.shape[0]
+
+    def __getitem__(self, key):
+        categories, features = key if isinstance(key, tuple) else (key, slice(None))
+        if np.isscalar(categories) and np.isscalar(features):
+            return ContTable(tp=int(self.tp[categories, features]), tn=int(self.tn[categories, features]),
+                             fp=int(self.fp[categories, features]), fn=int(self.fn[categories, features]))
+        categories = [categories] if np.isscalar(categories) else categories
+        features = [features] if np.isscalar(features) else features
+        return ContingencyTensor(*[cell[categories][:, features] for cell in [self.tp, self.fp, self.fn, self.tn]])
+
+    # the tensor of the union of two disjoint sets of documents
+    def __add__(self, other):
+        return ContingencyTensor(tp=self.tp+other.tp, fp=self.fp+other.fp, fn=self.fn+other.fn, tn=self.tn+other.tn)
+
+    def get_d(self): return self.tp + self.tn + self.fp + self.fn
+
+    def get_c(self): return self.tp + self.fn
+
+    def get_not_c(self): return self.tn + self.fp
+
+    def get_f(self): return self.tp + self.fp
+
+    def get_not_f(self): return self.tn + self.fn
+
+    def p_c(self): return (1.0*self.get_c())/self.get_d()
+
+    def p_not_c(self): return 1.0-self.p_c()
+
+    def p_f(self): return (1.0*self.get_f())/self.get_d()
+
+    def p_not_f(self): return 1.0-self.p_f()
+
+    def p_tp(self): return (1.0*self.tp) / self.get_d()
+
+    def p_tn(self): return (1.0*self.tn) / self.get_d()
+
+    def p_fp(self): return (1.0*self.fp) / self.get_d()
+
+    def p_fn(self): return (1.0*self.fn) / self.get_d()
+
+    def tpr(self): return _safe_ratio(self.tp, self.get_c())
+
+    def fpr(self): return _safe_ratio(self.fp, self.get_not_c())
+
+class ContingencyCounts(ContingencyTensor):
+    """
+    ContingencyTensor kept as its sufficient counts: the (nC, nF) true positives tp, the (nF) document frequencies df of
+    the features, the (nC) number of documents nc of each category, and the number of documents nD, from which fp, fn,
+    and tn are derived. Documents can thus be added to (or removed from) the counts in time proportional to their
+    non-zeros, e.g., to refresh the supervised weights of a continuously fed collection without a full pass; a
+    relabelled document is removed with its old labels and added with the new ones. The removed documents are assumed
+    to have been counted.
+    """
+    def __init__(self, tp, df, nc, nD):
+        self._tp = np.atleast_2d(np.array(tp, dtype=int))
+        self.df = np.array(df, dtype=int).reshape(-1)
+        self.nc = np.array(nc, dtype=int).reshape(-1)
+        self.nD = int(nD)
+
+    @property
+    def tp(self): return self._tp
+
+    @property
+    def fp(self): return self.df.reshape(1, -1) - self._tp
+
+    @property
+    def fn(self): return self.nc.reshape(-1, 1) - self._tp
+
+    @property
+    def tn(self): return self.nD - (self.df.reshape(1, -1) + self.nc.reshape(-1, 1) - self._tp)
+
+    @property
+    def shape(self):
+        return self._tp.shape
+
+    def __getitem__(self, key):
+        categories, features = key if isinstance(key, tuple) else (key, slice(None))
+        if np.isscalar(categories) and np.isscalar(features):
+            tp = int(self._tp[categories, features])
+            fp, fn = int(self.df[features]) - tp, int(self.nc[categories]) - tp
+            return ContTable(tp=tp, fp=fp, fn=fn, tn=self.nD - (tp + fp + fn))
+        return super(ContingencyCounts, self).__getitem__(key)
+
+    # adds the documents with (nd x nF) feature matrix X_rows and (nd x nC) label matrix Y_rows
+    def add(self, X_rows, Y_rows):
+        self._update(X_rows, Y_rows, 1)
+
+    # removes the documents with (nd x nF) feature matrix X_rows and (nd x nC) label matrix Y_rows
+    def remove(self, X_rows, Y_rows):
+        self._update(X_rows, Y_rows, -1)
+
+    def _update(self, X_rows, Y_rows, sign):
+        occurrences = csr_matrix(X_rows, copy=True)
+        occurrences.eliminate_zeros()
+        occurrences.data = np.ones_like(occurrences.indices)
+        labels = csr_matrix(csr_matrix(Y_rows) != 0, dtype=int)
+        if occurrences.shape[0] != labels.shape[0] or (occurrences.shape[1], labels.shape[1]) != self.shape[::-1]:
+            raise ValueError('Shapes of the documents %s and labels %s are not consistent with the counts %s' %
+                             (occurrences.shape, labels.shape, self.shape))
+        delta_tp = (labels.T * occurrences).tocoo()
+        self._tp[delta_tp.row, delta_tp.col] += sign * delta_tp.data
+        np.add.at(self.df, occurrences.indices, sign)
+        np.add.at(self.nc, labels.indices, sign)
+        self.nD += sign * occurrences.shape[0]
+
+# elementwise num/den, with 0 where den is 0
+# num / den (as floats, also for integer counts) where den > 0, and 0 elsewhere
+def _safe_ratio(num, den):
+    ratio = np.zeros(np.broadcast(num, den).shape)
+    np.true_divide(num, den, out=ratio, where=np.asarray(den) > 0)
+    return ratio
+
+
 def feature_label_contingency_table(positive_document_indexes, feature_document_indexes, nD):
     tp_ = len(positive_document_indexes & feature_document_indexes)
     fp_ = len(feature_document_indexes - positive_document_indexes)
@@ -163,15 +335,45 @@ def feature_label_contingency_table(positive_document_indexes, feature_document_
     tn_ = nD - (tp_ + fp_ + fn_)
     return ContTable(tp=tp_, tn=tn_, fp=fp_, fn=fn_)
 
-def category_tables(feature_sets, category_sets, c, nD, nF):
-    return [feature_label_contingency_table(category_sets[c], feature_sets[f], nD) for f in range(nF)]
+def category_true_positives(feature_sets, category_set):
+    return [len(category_set & feature_set) for feature_set in feature_sets]
+
+
+"""
+Computes the nC x nF supervised matrix M where Mcf is the 4-cell contingency table for feature f and class c, as a
+ContingencyCounts (which can be updated as documents are added or removed). All the cells follow from the true
+positives tp = Y^T B (with Y the nD x nC label matrix and B the binarized nD x nF coocurrence matrix), the document
+frequency of each feature, and the number of documents of each category. The product is computed in blocks of block_size columns, so that the intermediate sparse products stay
+bounded for huge vocabularies. The n_jobs parameter is kept for compatibility, and is ignored.
+"""
+def get_supervised_matrix(coocurrence_matrix, label_matrix, n_jobs=-1, block_size=10000):
+    nD, nF = coocurrence_matrix.shape
+    nD2, nC = label_matrix.shape
+
+    if nD != nD2:
+        raise ValueError('Number of rows in coocurrence matrix shape %s and label matrix shape %s is not consistent' %
+                         (coocurrence_matrix.shape,label_matrix.shape))
 
+    label_matrix = csr_matrix(csr_matrix(label_matrix) != 0, dtype=int)
+    occurrences = csc_matrix(coocurrence_matrix, copy=True)
+    occurrences.eliminate_zeros()
+    occurrences.data = np.ones_like(occurrences.indices)
+    labels_T = label_matrix.T.tocsr()
+    tp = np.zeros((nC, nF), dtype=int)
+    for start in range(0, nF, block_size):
+        end = min(start + block_size, nF)
+        tp[:, start:end] = (labels_T * occurrences[:, start:end]).toarray()
+    df = np.diff(occurrences.indptr)
+    nc = np.asarray(label_matrix.sum(axis=0)).ravel()
+    return ContingencyCounts(tp, df, nc, nD)
 
 """
-Computes the nC x nF supervised matrix M where Mcf is the 4-cell contingency table for feature f and class c.
+Set-based computation of the same supervised matrix as get_supervised_matrix: the (sets of) documents of each category
+are intersected with the documents of each feature, in n_jobs threads. It is kept as a reference (see
+supervised_matrix_benchmark.py).
 Efficiency O(nF x nC x log(S)) where S is the sparse factor
 """
-def get_supervised_matrix(coocurrence_matrix, label_matrix, n_jobs=-1):
+def get_supervised_matrix_setbased(coocurrence_matrix, label_matrix, n_jobs=-1):
     nD, nF = coocurrence_matrix.shape
     nD2, nC = label_matrix.shape
 
@@ -186,13 +388,41 @@ def get_supervised_matrix(coocurrence_matrix, label_matrix, n_jobs=-1):
         coocurrence_matrix = csc_matrix(coocurrence_matrix)
     feature_sets = [nonzero_set(coocurrence_matrix, f) for f in range(nF)]
     category_sets = [nonzero_set(label_matrix, c) for c in range(nC)]
-    cell_matrix = Parallel(n_jobs=n_jobs, backend="threading")(delayed(category_tables)(feature_sets, category_sets, c, nD, nF) for c in range(nC))
-    return np.array(cell_matrix)
+    tp = Parallel(n_jobs=n_jobs, backend="threading")(delayed(category_true_positives)(feature_sets, category_sets[c]) for c in range(nC))
+    df = [len(feature_set) for feature_set in feature_sets]
+    nc = [len(category_set) for category_set in category_sets]
+    return ContingencyCounts(np.array(tp, dtype=int).reshape(nC, nF), df, nc, nD)
 
-# obtains the matrix T where Tcf=tsr(f,c) is the tsr score for category c and feature f
+"""
+Computes the same nC x nF supervised matrix (ContingencyCounts) as get_supervised_matrix, for a coocurrence matrix given
+as a sequence of (row_offset, block) row-blocks (e.g., from ShardedMatrix.iter_blocks), so that the matrix is never in
+memory as a whole. The label_matrix is a (sparse or dense) nD x nC matrix aligned with the rows of the blocks.
+"""
+def get_supervised_matrix_from_blocks(blocks, label_matrix):
+    label_matrix = csr_matrix(csr_matrix(label_matrix) != 0, dtype=int)
+    nD, nC = label_matrix.shape
+    tp, df = None, None
+    for row_offset, block in blocks:
+        occurrences = csr_matrix(block, copy=True)
+        occurrences.eliminate_zeros()
+        occurrences.data = np.ones_like(occurrences.indices)
+        if tp is None:
+            tp = np.zeros((nC, occurrences.shape[1]), dtype=int)
+            df = np.zeros(occurrences.shape[1], dtype=int)
+        tp += (label_matrix[row_offset:row_offset + occurrences.shape[0]].T * occurrences).toarray()
+        df += np.asarray(occurrences.sum(axis=0)).ravel()
+    if tp is None:
+        tp, df = np.zeros((nC, 0), dtype=int), np.zeros(0, dtype=int)
+    nc = np.asarray(label_matrix.sum(axis=0)).ravel()
+    return ContingencyCounts(tp, df, nc, nD)
+
+# obtains the matrix T where Tcf=tsr(f,c) is the tsr score for category c and feature f; the cell_matrix can be either a
+# ContingencyTensor or a nC x nF array of ContTable objects. Vectorized tsr functions score a ContingencyTensor at once,
+# while any other function is called on the ContTable of each pair
 def get_tsr_matrix(cell_matrix, tsr_score_funtion):
-    nC = len(cell_matrix)
-    nF = len(cell_matrix[0])
+    nC, nF = cell_matrix.shape
+    if isinstance(cell_matrix, ContingencyTensor) and getattr(tsr_score_funtion, 'vectorized', False):
+        return np.asarray(tsr_score_funtion(cell_matrix), dtype=float).reshape(nC, nF)
     tsr_matrix = [[tsr_score_funtion(cell_matrix[c,f]) for f in range(nF)] for c in range(nC)]
     #tsr_matrix = Parallel(n_jobs=-1, backend="threading")(delayed(tsr_with_index)(cell_matrix[c], self._score_func) for c in range(nC))
     return np.array(tsr_matrix)
@@ -225,3 +455,35 @@ def fisher_score_binary(feat, c):
         return num / den
     else:
         return num
+
+
+"""
+Fisher score (see fisher_score_binary) of every feature (column of the real-valued nD x nF matrix X) with respect to
+every category (column of the nD x nC label matrix), as a nC x nF array. The means and variances of each feature inside
+and outside each category follow from the sparse column sums and sums of squares of X, split by label with Y^T X, so
+X is never densified. A category (or its complement) with no documents contributes 0 to both terms of the score.
+"""
+def fisher_score_matrix(X, label_matrix):
+    X = csr_matrix(X, dtype=float)
+    label_matrix = csr_matrix(csr_matrix(label_matrix) != 0, dtype=float)
+    nD = X.shape[0]
+    if label_matrix.shape[0] != nD:
+        raise ValueError('Number of rows in matrix shape %s and label matrix shape %s is not consistent' %
+                         (X.shape, label_matrix.shape))
+    labels_T = label_matrix.T.tocsr()
+    sum_all = np.asarray(X.sum(axis=0)).ravel()
+    sumsq_all = np.asarray(X.multiply(X).sum(axis=0)).ravel()
+    sum_pos = (labels_T * X).toarray()
+    sumsq_pos = (labels_T * X.multiply(X)).toarray()
+    sum_neg, sumsq_neg = sum_all - sum_pos, sumsq_all - sumsq_pos
+    npos = np.asarray(label_matrix.sum(axis=0)).reshape(-1, 1)
+    nneg = nD - npos
+
+    mu = sum_all / nD
+    mupos = _safe_ratio(sum_pos, npos)
+    muneg = _safe_ratio(sum_neg, nneg)
+    num = npos * ((mupos - mu) ** 2) + nneg * ((muneg - mu) ** 2)
+    # npos * stdpos^2 + nneg * stdneg^2, i.e., the sum of squared deviations from the mean of each class
+    den = (sumsq_pos - npos * mupos ** 2) + (sumsq_neg - nneg * muneg ** 2)
+    den[den <= 1e-12 * sumsq_all] = 0.0 # rounding residuals of features with no variance
+    return np.where(den > 0, num / np.where(den > 0, den, 1.0), num)
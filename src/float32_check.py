@@ -0,0 +1,45 @@
+from __future__ import print_function
+import argparse
+from sklearn import svm
+from data.dataset_loader import *
+
+# This script checks that running the pipeline in float32 (dtype option of TextCollectionLoader) does not harm the
+# classification performance: for each vectorizer and category, a LinearSVM is trained on the float64 and on the
+# float32 vectors, and the F1 scores on the test set are required not to differ by more than a tolerance.
+
+def matrix_bytes(X):
+    return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+
+def test_f1(data, C):
+    trX, trY = data.get_train_set()
+    teX, teY = data.get_test_set()
+    predictions = svm.LinearSVC(C=C).fit(trX, trY).predict(teX)
+    _, f1, _, _ = evaluation_metrics(predictions=predictions, true_labels=teY)
+    return f1
+
+if __name__ == '__main__':
+    sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)  # set stdout to unbuffered
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--dataset", help="dataset on which to run the check (default reuters21578)", choices=TextCollectionLoader.valid_datasets, default='reuters21578')
+    parser.add_argument("-m", "--method", help="vectorizers to check (default tfidf, sublinear_tfidf, and bm25)", nargs='+',
+                        choices=TextCollectionLoader.valid_vectorizers, default=['tfidf', 'sublinear_tfidf', 'bm25'])
+    parser.add_argument("-c", "--cats", help="categories to check (default: the first 5 valid ones)", nargs='+', type=int, default=None)
+    parser.add_argument("--fs", help="feature selection ratio (default 0.1)", type=float, default=0.1)
+    parser.add_argument("--tol", help="maximum absolute difference allowed in F1 (default 0.01)", type=float, default=0.01)
+    args = parser.parse_args()
+
+    cats = args.cats if args.cats is not None else TextCollectionLoader.valid_catcodes[args.dataset][:5]
+    failures = 0
+    for vectorizer in args.method:
+        for cat in cats:
+            data64 = TextCollectionLoader(dataset=args.dataset, vectorizer=vectorizer, positive_cat=cat, feat_sel=args.fs)
+            data32 = TextCollectionLoader(dataset=args.dataset, vectorizer=vectorizer, positive_cat=cat, feat_sel=args.fs, dtype=np.float32)
+            f1_64, f1_32 = test_f1(data64, C=1.0), test_f1(data32, C=1.0)
+            ok = abs(f1_64 - f1_32) <= args.tol
+            failures += 0 if ok else 1
+            print('%s cat=%d: f1(float64)=%.4f f1(float32)=%.4f diff=%.4f [%s] memory %.1fMB -> %.1fMB' %
+                  (vectorizer, cat, f1_64, f1_32, abs(f1_64 - f1_32), 'ok' if ok else 'FAIL',
+                   matrix_bytes(data64.devel_vec) / 1e6, matrix_bytes(data32.devel_vec) / 1e6))
+    print('%d failures' % failures)
+    sys.exit(1 if failures > 0 else 0)
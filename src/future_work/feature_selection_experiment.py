@@ -4,6 +4,7 @@ import warnings
 warnings.warn = warn
 
 import os, sys
+import copy
 from data.dataset_loader import TextCollectionLoader
 from sklearn.svm import LinearSVC
 from sklearn.multiclass import OneVsRestClassifier
@@ -228,7 +229,7 @@ def plot_fs_roundrobin(dataset, fs_ratios, resultfile, tsr_function, plotter, co
             fs_ratios.sort()
             result_series = []
             for i,ratio in enumerate(fs_ratios):
-                data = TextCollectionLoader(dataset=dataset, feat_sel=ratio, tsr_function=tsr_function)
+                data = TextCollectionLoader(dataset=dataset, feat_sel=ratio, score_func=tsr_function)
                 macro_f1, micro_f1 = linear_svm(data)
                 results.write(resultpath + str(ratio) + "\t" + str(macro_f1) + "\t" + str(micro_f1) + "\n")
                 result_series.append((macro_f1, micro_f1))
@@ -248,25 +249,27 @@ def plot_fs_roundrobin_eqclasses(dataset, fs_ratios, resultfile, tsr_function, e
         with open(resultfile, 'w') as results:
             data = TextCollectionLoader(dataset=dataset)
             original_classification = data.devel.target
-            ranked_features_pickle = resultpath + dataset+'_'+tsr_function.__name__+'_'+eq_class_method.__name__+".pickle"
             eqclass_classification = eq_class_method(original_classification)
 
+            # the features are ranked once (on the full matrix, with the equivalence classes) for all ratios
+            data.devel.target = eqclass_classification
+            ranking = data.feature_ranking(score_func=tsr_function)
+            data.devel.target = original_classification
+            num_features = data.num_features()
+            data.test_vec # the full test subset is loaded once, and then sliced by each copy
+
             fs_ratios.sort()
             result_series = []
             for i,ratio in enumerate(fs_ratios):
                 print "Ratio",ratio,"completed",(i+1),'/',len(fs_ratios)
-                data.devel.target = eqclass_classification
-                data.feature_selection(feat_sel=ratio, score_func=tsr_function, features_rank_pickle_path=ranked_features_pickle)
-                data.devel.target = original_classification
+                # each ratio selects from a fresh copy of the full loader
+                ratio_data = copy.copy(data)
+                ratio_data.feature_selection(feat_sel=int(ratio*num_features), ranking=ranking)
 
-                macro_f1, micro_f1 = linear_svm(data)
+                macro_f1, micro_f1 = linear_svm(ratio_data)
                 results.write(resultpath +str(ratio)+"\t"+str(macro_f1)+"\t"+str(micro_f1)+"\n")
                 result_series.append((macro_f1, micro_f1))
 
-                #reload data
-                if i < len(fs_ratios)-1:
-                    data = TextCollectionLoader(dataset=dataset)
-
     macro,micro = zip(*result_series)
     plotter.add_result(macro, micro, color, legend)
 
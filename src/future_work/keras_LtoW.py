@@ -11,10 +11,8 @@ from data.dataset_loader import TextCollectionLoader
 from metrics import macroF1, microF1
 
 def get_tpr_fpr_statistics(data):
-    nC = data.num_categories()
-    nF = data.num_features()
     matrix_4cell = data.get_4cell_matrix()
-    feat_corr_info = np.array([[[matrix_4cell[c, f].tpr(), matrix_4cell[c, f].fpr()] for f in range(nF)] for c in range(nC)])
+    feat_corr_info = np.dstack([matrix_4cell.tpr(), matrix_4cell.fpr()])
     info_by_feat = feat_corr_info.shape[-1]
     return feat_corr_info, info_by_feat
 
@@ -81,17 +81,18 @@ def main(argv=None):
         timeref = time.time()
         best_f1, best_alpha, best_beta = 0.0, 1.0, 1.0
         savedstep = -1
+        train_batches = data.train_batch_iterator(batch_size)
         for step in range(1,FLAGS.maxsteps):
-            x_,y_ = data.train_batch(batch_size)
+            x_,y_ = train_batches.next()
             _, l, alpha, beta = session.run([optimizer, loss, tf_param, idf_param], feed_dict={x:x_, y:y_})
             l_ave += l
 
             if step % show_step == 0:
-                print('[step=%d][ep=%d][alpha=%.4f, beta=%.4f] loss=%.10f' % (step, data.epoch, alpha, beta, l_ave / show_step))
+                print('[step=%d][ep=%d][alpha=%.4f, beta=%.4f] loss=%.10f' % (step, train_batches.epoch, alpha, beta, l_ave / show_step))
                 l_ave = 0.0
 
             if step % valid_step == 0:
-                print ('Average time/step %.4fs' % ((time.time()-timeref)/valid_step))
+                print ('Average time/step %.4fs (waiting for data %.4fs/batch)' % ((time.time()-timeref)/valid_step, train_batches.average_wait_time()))
                 x_,y_ = data.val_batch()
                 predictions = prediction.eval(feed_dict={x:x_, y:y_})
                 acc, f1, p, r = evaluation_metrics(predictions, y_)
@@ -112,6 +113,7 @@ def main(argv=None):
             if best_f1==1.0:
                 print('Max validation score reached. End of training.')
                 break
+        train_batches.close()
 
         # output -------------------------------------------------
         print 'Test evaluation:'
@@ -2,6 +2,7 @@ import numpy as np
 from numpy import log
 from sklearn.linear_model import LogisticRegression
 from data.dataset_loader import TextCollectionLoader
+from data.custom_vectorizers import as_dtype
 import cPickle as pickle
 from utils.helpers import create_if_not_exists
 import os
@@ -17,22 +18,24 @@ from cca_terminals import *
 # ----------------------------------------------------------------
 # Collection Loader
 # ----------------------------------------------------------------
-def loadCollection(dataset, pos_cat, fs, data_home='../genetic_home'):
+def loadCollection(dataset, pos_cat, fs, data_home='../genetic_home', dtype=np.float64):
     version = TextCollectionLoader.version
     create_if_not_exists(data_home)
-    pickle_name = '-'.join(map(str,[dataset,pos_cat,fs,version]))+'.pkl'
+    pickle_name = '-'.join(map(str,[dataset,pos_cat,fs,version,np.dtype(dtype).name]))+'.pkl'
     pickle_path = os.path.join(data_home, pickle_name)
     if not os.path.exists(pickle_path):
-        data = TextCollectionLoader(dataset=dataset, vectorizer='count', rep_mode='sparse', positive_cat=pos_cat,feat_sel=fs)
+        # the matrices are built in dtype by the loader itself
+        data = TextCollectionLoader(dataset=dataset, vectorizer='count', rep_mode='sparse', positive_cat=pos_cat,feat_sel=fs, dtype=dtype)
         Xtr, ytr = data.get_train_set()
         Xva, yva = data.get_validation_set()
         Xte, yte = data.get_test_set()
         pickle.dump((Xtr,ytr,Xva,yva,Xte,yte), open(pickle_path,'wb'), pickle.HIGHEST_PROTOCOL)
     else:
         Xtr, ytr, Xva, yva, Xte, yte = pickle.load(open(pickle_path,'rb'))
-    Xtr=Xtr.asfptype()
-    Xva=Xva.asfptype()
-    Xte=Xte.asfptype()
+    # no copy if already in dtype; index arrays are downcast to int32 when possible
+    Xtr=as_dtype(Xtr, dtype)
+    Xva=as_dtype(Xva, dtype)
+    Xte=as_dtype(Xte, dtype)
     return Xtr,ytr,Xva,yva,Xte,yte
 
 
@@ -0,0 +1,50 @@
+from __future__ import print_function
+import argparse
+import multiprocessing
+from data.dataset_loader import *
+
+# This script measures the throughput (documents per second) of the hashing vectorizer when the documents are hashed
+# in chunks by an increasing number of processes (see parallel_hashing_transform), and checks that the parallel
+# output is identical to the serial one.
+
+def time_hashing(vectorizer, documents, n_jobs, chunk_size, repeats):
+    elapsed = []
+    for _ in range(repeats):
+        tinit = time.time()
+        X = parallel_hashing_transform(vectorizer, documents, n_jobs=n_jobs, chunk_size=chunk_size)
+        elapsed.append(time.time() - tinit)
+    return X, min(elapsed)
+
+def same_matrix(X, Y):
+    return X.shape == Y.shape and (X != Y).nnz == 0
+
+if __name__ == '__main__':
+    sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)  # set stdout to unbuffered
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--dataset", help="datasets on which to run the benchmark (default 20newsgroups and imdb)",
+                        choices=TextCollectionLoader.valid_datasets, nargs='+', default=['20newsgroups', 'imdb'])
+    parser.add_argument("-c", "--chunksize", help="number of documents hashed by each task (default 1000)", type=int, default=1000)
+    parser.add_argument("-r", "--repeats", help="number of timings per configuration; the best one is reported (default 3)", type=int, default=3)
+    parser.add_argument("-j", "--maxjobs", help="maximum number of processes (default: number of cores)", type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    n_jobs_list = sorted(set([1] + [2**i for i in range(1, 10) if 2**i < args.maxjobs] + [args.maxjobs]))
+
+    for dataset in args.dataset:
+        print('Dataset: %s' % dataset)
+        data = TextCollectionLoader(dataset=dataset, vectorizer='hashing')
+        documents = list(data.devel.data) + list(data.test.data) # decoded in advance, so that only hashing is timed
+        vectorizer = HashingVectorizer(n_features=2**16, stop_words='english', non_negative=True)
+        serial_X, serial_time = time_hashing(vectorizer, documents, 1, args.chunksize, args.repeats)
+        print('%d documents' % len(documents))
+        print('%6s %10s %12s %8s %10s %s' % ('n_jobs', 'time(s)', 'docs/s', 'speedup', 'efficiency', 'same-output'))
+        for n_jobs in n_jobs_list:
+            if n_jobs == 1:
+                X, elapsed = serial_X, serial_time
+            else:
+                X, elapsed = time_hashing(vectorizer, documents, n_jobs, args.chunksize, args.repeats)
+            speedup = serial_time / elapsed
+            print('%6d %10.3f %12.1f %8.2f %10.2f %s' % (n_jobs, elapsed, len(documents) / elapsed, speedup,
+                                                         speedup / n_jobs, same_matrix(X, serial_X)))
+        print('-'*80)
@@ -0,0 +1,63 @@
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# This script reports the import time of the modules launched by the job scripts (learn_jobs.sh, genetic_jobs.sh),
+# each one measured in a fresh interpreter, and checks that it stays under a time budget and that none of the heavy
+# modules that are only needed to download collections, to plot, or to compute statistics (nltk, sklearn.datasets,
+# matplotlib, scipy.stats) are imported eagerly. The exit code is 1 if any check fails.
+
+LAZY_MODULES = ['nltk', 'sklearn.datasets', 'matplotlib', 'scipy.stats']
+
+CHILD_CODE = """
+import sys, time, json
+before = set(sys.modules)
+tinit = time.time()
+__import__(%r)
+elapsed = time.time() - tinit
+loaded = sorted(m for m in set(sys.modules) - before if sys.modules[m] is not None)
+print(json.dumps({'time': elapsed, 'loaded': loaded}))
+"""
+
+def time_import(module, python):
+    out = subprocess.check_output([python, '-c', CHILD_CODE % module], cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(out.strip().split('\n')[-1])
+
+def top_packages(loaded, n=5):
+    counts = {}
+    for module in loaded:
+        package = module.split('.')[0]
+        counts[package] = counts.get(package, 0) + 1
+    return sorted(counts.items(), key=lambda x: -x[1])[:n]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--modules", help="modules to check (default: the scripts of the job files and the loader)", nargs='+',
+                        default=['data.dataset_loader', 'classification_benchmark', 'supervised_weighting', 'genetic_programming_cca'])
+    parser.add_argument("-b", "--budget", help="maximum import time in seconds (default 2.0)", type=float, default=2.0)
+    parser.add_argument("-r", "--repeats", help="number of timings per module; the best one is reported (default 3)", type=int, default=3)
+    parser.add_argument("--python", help="interpreter to run the imports with (default: the current one)", default=sys.executable)
+    args = parser.parse_args()
+
+    failures = 0
+    print('%-30s %8s %8s  %s' % ('module', 'time(s)', 'modules', 'eagerly imported'))
+    for module in args.modules:
+        try:
+            reports = [time_import(module, args.python) for _ in range(args.repeats)]
+        except subprocess.CalledProcessError:
+            print('%-30s import failed' % module)
+            failures += 1
+            continue
+        best = min(report['time'] for report in reports)
+        loaded = reports[0]['loaded']
+        eager = [lazy for lazy in LAZY_MODULES if lazy in loaded]
+        ok = best <= args.budget and not eager
+        failures += 0 if ok else 1
+        print('%-30s %8.3f %8d  %s %s' % (module, best, len(loaded), ','.join(eager) if eager else '-', '' if ok else '[FAIL]'))
+        print('%-30s largest packages: %s' % ('', ', '.join('%s(%d)' % p for p in top_packages(loaded))))
+
+    print('%d module(s) out of budget' % failures if failures else 'All imports under budget')
+    sys.exit(1 if failures else 0)
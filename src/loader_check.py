@@ -0,0 +1,58 @@
+from __future__ import print_function
+import argparse
+from data.dataset_loader import *
+
+# This script checks some corner cases of TextCollectionLoader on a collection (built with no disk caches, so that the
+# checked matrices are computed afresh). Each check returns a list of (passed, message) pairs, which are printed; the
+# exit code is 1 if any check fails.
+
+def check_multilabel_supervised(dataset):
+    # the supervised vectorizers of a non-binarized (e.g., multi-label) loader weight towards no positive category
+    outcomes = []
+    for vectorizer in ['tfig', 'tfgr', 'tfchi2', 'tfrf', 'tfcw']:
+        data = TextCollectionLoader(dataset=dataset, vectorizer=vectorizer, use_cache=False)
+        ok = data.devel_vec.shape[0] == len(data.devel.data) and data.test_vec.shape[1] == data.devel_vec.shape[1]
+        outcomes.append((ok, 'non-binarized loader with vectorizer %s: devel %s, test %s' % (vectorizer, data.devel_vec.shape, data.test_vec.shape)))
+    return outcomes
+
+def check_view_of_selected_loader(dataset):
+    # the features of a view would be selected for all categories, and not towards its positive category
+    data = TextCollectionLoader(dataset=dataset, vectorizer='count', feat_sel=0.1, use_cache=False)
+    try:
+        data.view(TextCollectionLoader.valid_catcodes[dataset][0])
+        return [(False, 'view taken from a feature-selected loader')]
+    except ValueError:
+        return [(True, 'view of a feature-selected loader rejected')]
+
+def check_padded_empty_batch(dataset):
+    # the padded representation of batches with no documents, or with no features at all, keeps its shapes
+    outcomes = []
+    for vectorizer in ['tfidf', 'binary']:
+        data = TextCollectionLoader(dataset=dataset, vectorizer=vectorizer, rep_mode='padded_index', use_cache=False)
+        for nD in [0, 3]:
+            ids, weights, lengths = data.get_padded_index_values(csr_matrix((nD, data.num_features())))
+            weights_ok = weights is None if vectorizer == 'binary' else weights.shape == (nD, 0)
+            ok = ids.shape == (nD, 0) and weights_ok and lengths.shape == (nD,)
+            outcomes.append((ok, '%s batch of %d empty documents: ids %s, weights %s, lengths %s' %
+                             (vectorizer, nD, ids.shape, None if weights is None else weights.shape, lengths.shape)))
+    return outcomes
+
+CHECKS = {'multilabel_supervised': check_multilabel_supervised,
+          'view_of_selected_loader': check_view_of_selected_loader,
+          'padded_empty_batch': check_padded_empty_batch}
+
+if __name__ == '__main__':
+    sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)  # set stdout to unbuffered
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--dataset", help="dataset on which to run the checks (default reuters21578)", choices=TextCollectionLoader.valid_datasets, default='reuters21578')
+    parser.add_argument("-c", "--checks", help="checks to run (default: all)", nargs='+', choices=sorted(CHECKS.keys()), default=sorted(CHECKS.keys()))
+    args = parser.parse_args()
+
+    failures = 0
+    for check in args.checks:
+        for ok, msg in CHECKS[check](args.dataset):
+            failures += 0 if ok else 1
+            print('%s: %s [%s]' % (check, msg, 'ok' if ok else 'FAIL'))
+    print('%d failures' % failures)
+    sys.exit(1 if failures > 0 else 0)
@@ -0,0 +1,46 @@
+from __future__ import print_function
+import argparse
+from data.dataset_loader import *
+
+# This script compares the time needed to compute the supervised 4-cell matrix of the devel set of each collection
+# (all categories, full vocabulary) with the set-based implementation (get_supervised_matrix_setbased) and with the
+# sparse matrix product (get_supervised_matrix) for different column block sizes, and checks that both agree.
+
+def time_supervised_matrix(function, X, Y, repeats, **kwargs):
+    elapsed = []
+    for _ in range(repeats):
+        tinit = time.time()
+        M = function(X, Y, **kwargs)
+        elapsed.append(time.time() - tinit)
+    return M, min(elapsed)
+
+def same_tensor(M1, M2):
+    return M1.shape == M2.shape and all(np.array_equal(getattr(M1, cell), getattr(M2, cell)) for cell in ['tp', 'fp', 'fn', 'tn'])
+
+if __name__ == '__main__':
+    sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)  # set stdout to unbuffered
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--dataset", help="datasets on which to run the benchmark (default reuters21578, ohsumed, and 20newsgroups)",
+                        choices=TextCollectionLoader.valid_datasets, nargs='+', default=['reuters21578', 'ohsumed', '20newsgroups'])
+    parser.add_argument("-b", "--blocksizes", help="column block sizes of the sparse product (default 1000 10000 100000)",
+                        type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument("-r", "--repeats", help="number of timings per configuration; the best one is reported (default 3)", type=int, default=3)
+    parser.add_argument("--skipsets", help="skip the (slow) set-based implementation", default=False, action='store_true')
+    args = parser.parse_args()
+
+    for dataset in args.dataset:
+        data = TextCollectionLoader(dataset=dataset, vectorizer='count')
+        X, Y = data.devel_vec, data.devel_labels.matrix
+        print('Dataset: %s (nD=%d, nF=%d, nC=%d, nnz=%d)' % (dataset, X.shape[0], X.shape[1], Y.shape[1], X.nnz))
+        print('%-24s %10s %8s %s' % ('method', 'time(s)', 'speedup', 'same-output'))
+        reference, reference_time = None, None
+        if not args.skipsets:
+            reference, reference_time = time_supervised_matrix(get_supervised_matrix_setbased, X, Y, 1)
+            print('%-24s %10.3f %8.2f %s' % ('set-based', reference_time, 1.0, True))
+        for block_size in args.blocksizes:
+            M, elapsed = time_supervised_matrix(get_supervised_matrix, X, Y, args.repeats, block_size=block_size)
+            speedup = reference_time / elapsed if reference is not None else float('nan')
+            same = same_tensor(M, reference) if reference is not None else '-'
+            print('%-24s %10.3f %8.2f %s' % ('sparse product (%d)' % block_size, elapsed, speedup, same))
+        print('-'*80)
@@ -1,18 +1,30 @@
 import os
 os.environ['MATPLOTLIB_USE'] = 'Agg'
+import time
 from time import gmtime, strftime
-from classification_benchmark_multi import *
+import numpy as np
+from sklearn.preprocessing import normalize
+from data.dataset_loader import TextCollectionLoader
+from data.weighted_vectors import WeightedVectors
 from feature_selection import tsr_function
+from utils.helpers import *
 from utils.tf_helpers import *
-from utils.plot_function import *
 
 def get_tpr_fpr_statistics(data):
-    nF = data.num_features()
     matrix_4cell = data.get_4cell_matrix()
-    feat_corr_info = np.array([[matrix_4cell[0, f].tpr(), matrix_4cell[0, f].fpr()] for f in range(nF)])
+    feat_corr_info = np.vstack([matrix_4cell.tpr()[0], matrix_4cell.fpr()[0]]).T
     info_by_feat = feat_corr_info.shape[-1]
     return feat_corr_info, info_by_feat
 
+# the test subset is only loaded (and l1-normalized, as the devel set, if the tf is not learnt) the first time it is
+# evaluated
+def get_test_set(data):
+    if data._test_vec is None:
+        test_vec = data.test_vec
+        data.test_vec = test_vec if FLAGS.learntf else normalize(test_vec, norm='l1', axis=1, copy=False)
+        print("|Te|=%d [prev+ %f]" % (data.num_test_documents(), data.test_class_prevalence(0)))
+    return data.get_test_set()
+
 def main(argv=None):
     err_exception(argv[1:], "Error in parameters %s (--help for documentation)." % argv[1:])
 
@@ -33,14 +45,12 @@ def main(argv=None):
     if not FLAGS.learntf:
         print('l1 normalization')
         data.devel_vec = normalize(data.devel_vec, norm='l1', axis=1, copy=False)
-        data.test_vec = normalize(data.test_vec, norm='l1', axis=1, copy=False)
     # updated code    #data = TextCollectionLoader(dataset=FLAGS.dataset, vectorizer='l1', rep_mode='dense', positive_cat=pos_cat_code, feat_sel=feat_sel, norm=None)
 
     max_tf = min(data.devel_vec.max(),50)#for the tf-like plot
 
     print("|Tr|=%d [prev+ %f]" % (data.num_tr_documents(), data.train_class_prevalence(0)))
     print("|Val|=%d [prev+ %f]" % (data.num_val_documents(), data.valid_class_prevalence(0)))
-    print("|Te|=%d [prev+ %f]" % (data.num_test_documents(), data.test_class_prevalence(0)))
     print("|V|=%d" % data.num_features())
     print("|C|=%d, %s" % (data.num_categories(), str(data.get_categories())))
 
@@ -187,7 +197,8 @@ def main(argv=None):
         def idf_wrapper(x):
             return idf_prediction.eval(feed_dict={x_func: [x], keep_p: 1.0})
         plot = PlotIdf(FLAGS.plotmode, FLAGS.plotdir,
-                       supervised_idf if FLAGS.pretrain!='off' else None, idf_wrapper, idf_points=feat_corr_info)
+                       supervised_idf if FLAGS.pretrain!='off' else None, idf_wrapper, idf_points=feat_corr_info) \
+            if FLAGS.plotmode != 'off' else None
         plotsteps = 100
         if FLAGS.pretrain != 'off':
             if FLAGS.plotmode in ['img', 'show']: plot.plot(step=0)
@@ -222,21 +233,22 @@ def main(argv=None):
         best_f1 = 0.0
         log_steps = 0
         savedstep = -1
+        train_batches = data.train_batch_iterator(batch_size)
         for step in range(1,FLAGS.maxsteps):
             in_logistic_phase = FLAGS.pretrain!='off' and step < logistic_optimization_phase
             optimizer_ = logistic_optimizer if in_logistic_phase else end2end_optimizer
-            tr_dict = as_feed_dict(data.train_batch(batch_size), dropout=True)
+            tr_dict = as_feed_dict(train_batches.next(), dropout=True)
             _, l  = session.run([optimizer_, loss], feed_dict=tr_dict)
             l_ave += l
             log_steps += 1
 
             if step % show_step == 0:
                 tr_phase = 'logistic' if in_logistic_phase else 'end2end'
-                print('[step=%d][ep=%d][op=%s] loss=%.10f' % (step, data.epoch, tr_phase, l_ave / show_step))
+                print('[step=%d][ep=%d][op=%s] loss=%.10f' % (step, train_batches.epoch, tr_phase, l_ave / show_step))
                 l_ave = 0.0
 
             if step % valid_step == 0:
-                print ('Average time/step %.4fs' % ((time.time()-timeref)/valid_step))
+                print ('Average time/step %.4fs (waiting for data %.4fs/batch)' % ((time.time()-timeref)/valid_step, train_batches.average_wait_time()))
                 val_x, val_y = data.get_validation_set()
                 predictions = predict(val_x, val_y)
                 acc, f1, p, r = evaluation_metrics(predictions, val_y)
@@ -250,7 +262,7 @@ def main(argv=None):
                     savedstep=step+idf_steps
                     savemodel(session, savedstep, saver, FLAGS.checkpointdir, 'model')
 
-                test_x, test_y = data.get_test_set()
+                test_x, test_y = get_test_set(data)
                 predictions = predict(test_x, test_y)
                 acc, f1, p, r = evaluation_metrics(predictions, test_y)
                 print('[Test acc=%.3f%%, f1=%.3f, p=%.3f, r=%.3f]' % (acc, f1, p, r))
@@ -274,6 +286,7 @@ def main(argv=None):
             if best_f1==1.0:
                 print('Max validation score reached. End of training.')
                 break
+        train_batches.close()
 
         if FLAGS.learntf:
             tfx = np.arange(start=0,stop=batch_size*x_size,step=1).reshape(batch_size,x_size)*max_tf/(batch_size*x_size)
@@ -288,7 +301,7 @@ def main(argv=None):
         if savedstep>0:
             restore_checkpoint(saver, session, FLAGS.checkpointdir)
         if FLAGS.plotmode in ['img', 'show']: plot.plot(step=savedstep)
-        test_x, test_y = data.get_test_set()
+        test_x, test_y = get_test_set(data)
         predictions = predict(test_x, test_y)
         acc, f1, p, r = evaluation_metrics(predictions, test_y)
         print('Logistic Regression acc=%.3f%%, f1=%.3f, p=%.3f, r=%.3f' % (acc, f1, p, r))
@@ -309,7 +322,7 @@ def main(argv=None):
         val_x, val_y   = data.get_validation_set()
         val_x_weighted = weight_docs(val_x)
 
-        test_x, test_y   = data.get_test_set()
+        test_x, test_y   = get_test_set(data)
         test_x_weighted = weight_docs(test_x)
 
         vectorizer_name = 'LtoW_'+FLAGS.computation+('learnTF' if FLAGS.learntf==True else '')
@@ -383,7 +396,9 @@ if __name__ == '__main__':
 
     sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)  # set stdout to unbuffered
 
-    if FLAGS.plotmode != 'show' or FLAGS.learntf==True:
-        os.environ['MATPLOTLIB_USE'] = 'Agg'
-    from utils.plot_function import PlotIdf
+    # matplotlib is only imported if something is to be plotted
+    if FLAGS.plotmode != 'off' or FLAGS.learntf==True:
+        if FLAGS.plotmode != 'show' or FLAGS.learntf==True:
+            os.environ['MATPLOTLIB_USE'] = 'Agg'
+        from utils.plot_function import PlotIdf, plotTF
     tf.app.run()
@@ -2,7 +2,8 @@ import os, sys
 import signal
 import math, random
 import shutil
-from sklearn.metrics import *
+import tempfile
+import cPickle as pickle
 
 #--------------------------------------------------------------
 # Run helpers
@@ -30,6 +31,18 @@ def create_if_not_exists(dir):
     if not os.path.exists(dir): os.makedirs(dir)
     return dir
 
+# pickles obj into a temporary file of the same directory, which is then renamed to path, so that a killed (or
+# concurrent) writer never leaves a truncated pickle in path
+def pickle_atomic(obj, path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fout:
+            pickle.dump(obj, fout, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+
 
 def tee(outstring, fout):
     print outstring
@@ -50,6 +63,7 @@ def shuffle_tied(l1, l2, random_seed=None):
 
 
 def evaluation_metrics(predictions, true_labels):
+    from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score # imports scipy.stats
     if len(true_labels.shape)==2: true_labels = true_labels.reshape(-1,1)
     no_test_examples = (sum(true_labels) == 0)
     no_predictions = (sum(predictions) == 0)